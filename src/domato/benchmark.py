@@ -0,0 +1,97 @@
+#   Domato - grammar expansion benchmark
+#   --------------------------------------
+#
+#   Compares the recursive and the iterative expansion engines of Grammar
+#   and the compiled grammar: all must generate the same samples for the
+#   same seeds. The engines are timed in turns, every rate is the median
+#   over the repetitions; single runs are too noisy to compare.
+#
+#   Usage: python benchmark.py [-n NUM] [--seed SEED] [-r REPEAT]
+
+
+from __future__ import print_function
+import os
+import time
+import argparse
+
+from generator import setup_grammars, generate_seeded_sample
+
+
+ENGINES = ['recursive', 'iterative', 'compiled']
+
+
+def set_engine(grammars, compiled, engine):
+    for grammar, module in zip(grammars, compiled):
+        grammar._iterative = engine == 'iterative'
+        grammar._compiled = module if engine == 'compiled' else None
+
+
+def run(template, grammars, compiled, seeds, engine):
+    """Generates a sample for every seed with one engine.
+    Args:
+      template: A template string.
+      grammars: The (htmlgrammar, cssgrammar) tuple.
+      compiled: The compiled modules of the grammars.
+      seeds: Seeds of the samples.
+      engine: One of ENGINES.
+    Returns:
+      A (samples, seconds) tuple.
+    """
+
+    set_engine(grammars, compiled, engine)
+    htmlgrammar, cssgrammar = grammars
+    samples = []
+    start = time.time()
+    for seed in seeds:
+        samples.append(generate_seeded_sample(template, htmlgrammar, cssgrammar, seed))
+    return samples, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Grammar expansion benchmark')
+    parser.add_argument('-n', '--no_of_samples', type=int, default=200,
+                        help='number of samples generated by each engine')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='first seed')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='number of timed runs of each engine')
+    args = parser.parse_args()
+
+    fuzzer_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(fuzzer_dir, 'template.html'), 'r') as f:
+        template = f.read()
+
+    grammars = setup_grammars()
+    if not grammars:
+        return
+    compiled = []
+    for grammar in grammars:
+        if grammar._compiled is None:
+            grammar.compile()
+        compiled.append(grammar._compiled)
+
+    seeds = range(args.seed, args.seed + args.no_of_samples)
+    rates = {engine: [] for engine in ENGINES}
+    outputs = {}
+    for _ in range(max(1, args.repeat)):
+        for engine in ENGINES:
+            samples, seconds = run(template, grammars, compiled, seeds, engine)
+            rates[engine].append(len(seeds) / seconds)
+            outputs.setdefault(engine, samples)
+
+    reference = outputs[ENGINES[0]]
+    for engine in ENGINES:
+        r = sorted(rates[engine])
+        print('%s: %.1f samples/s (median of %d, %.1f-%.1f)' %
+              (engine, r[len(r) // 2], len(r), r[0], r[-1]))
+        if engine == ENGINES[0]:
+            continue
+        mismatches = [seed for seed, a, b in zip(seeds, reference, outputs[engine]) if a != b]
+        if mismatches:
+            print('  %d samples differ, first seed %d' % (len(mismatches), mismatches[0]))
+        else:
+            print('  all %d samples are identical' % len(seeds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+#   Domato - attribute names in foreign content
+#   --------------------------------------
+#
+#   The HTML parser of the browser lowercases attribute names, except that
+#   in SVG and MathML content it restores the camel case of the names below
+#   (the "adjust SVG attributes" and "adjust MathML attributes" steps of the
+#   HTML parsing algorithm). html.parser and lxml lowercase every name, so
+#   structures collected with them are adjusted here to match the DOM.
+
+
+# Lowercased name -> name in the DOM of an SVG element
+_SVG_ATTRIBUTES = {name.lower(): name for name in (
+    'attributeName', 'attributeType', 'baseFrequency', 'baseProfile',
+    'calcMode', 'clipPathUnits', 'diffuseConstant', 'edgeMode',
+    'filterUnits', 'glyphRef', 'gradientTransform', 'gradientUnits',
+    'kernelMatrix', 'kernelUnitLength', 'keyPoints', 'keySplines',
+    'keyTimes', 'lengthAdjust', 'limitingConeAngle', 'markerHeight',
+    'markerUnits', 'markerWidth', 'maskContentUnits', 'maskUnits',
+    'numOctaves', 'pathLength', 'patternContentUnits', 'patternTransform',
+    'patternUnits', 'pointsAtX', 'pointsAtY', 'pointsAtZ', 'preserveAlpha',
+    'preserveAspectRatio', 'primitiveUnits', 'refX', 'refY', 'repeatCount',
+    'repeatDur', 'requiredExtensions', 'requiredFeatures',
+    'specularConstant', 'specularExponent', 'spreadMethod', 'startOffset',
+    'stdDeviation', 'stitchTiles', 'surfaceScale', 'systemLanguage',
+    'tableValues', 'targetX', 'targetY', 'textLength', 'viewBox',
+    'viewTarget', 'xChannelSelector', 'yChannelSelector', 'zoomAndPan',
+)}
+
+_MATHML_ATTRIBUTES = {'definitionurl': 'definitionURL'}
+
+# The children of these foreign elements are HTML again
+_INTEGRATION_POINTS = ('foreignobject', 'desc', 'title',
+                       'mi', 'mo', 'mn', 'ms', 'mtext')
+
+
+def adjust_attribute(name, tags):
+    """Returns an attribute name as the browser's DOM has it.
+
+    Args:
+      name: The attribute name, lowercased by the parser.
+      tags: Lowercased tag names of the element and its ancestors, the
+        element first.
+    Returns:
+      The name in camel case if the element is SVG or MathML content and
+      the browser adjusts it, the name otherwise.
+    """
+    for i, tag in enumerate(tags):
+        if tag == 'svg':
+            return _SVG_ATTRIBUTES.get(name, name)
+        if tag == 'math':
+            return _MATHML_ATTRIBUTES.get(name, name)
+        if i and tag in _INTEGRATION_POINTS:
+            break
+    return name
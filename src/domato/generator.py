@@ -20,10 +20,14 @@
 from __future__ import print_function
 import os
 import re
+import json
 import random
+import hashlib
 import argparse
 
-from grammar import Grammar
+from html.parser import HTMLParser
+from grammar import Grammar, BlockSampler
+from foreign import adjust_attribute
 from svg_tags import _SVG_TYPES
 from html_tags import _HTML_TYPES
 from mathml_tags import _MATHML_TYPES
@@ -32,6 +36,8 @@ from multiprocessing import Process
 
 
 _N_ADDITIONAL_HTMLVARS = 5
+# A seeded sample draws a few thousand numbers, see generate_seeded_sample
+_SEEDED_BLOCK_SIZE = 4096
 
 def generate_html_elements(ctx, n):
     for i in range(n):
@@ -68,6 +74,69 @@ def add_html_ids(matchobj, ctx):
 
 
 
+# Elements without an end tag
+_VOID_TAGS = ('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+              'link', 'meta', 'source', 'track', 'wbr')
+
+
+class StructureParser(HTMLParser):
+    """Collects element ids and attribute names of generated body elements.
+
+    Like the browser, only the first of duplicated attributes is kept and
+    attribute names of SVG and MathML content keep their camel case.
+    """
+
+    def __init__(self):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.ids = []
+        self.attributes = {}
+        self.open_tags = []
+
+    def record(self, tag, attrs):
+        tags = [tag] + self.open_tags[::-1]
+        names = []
+        for name, value in attrs:
+            name = adjust_attribute(name, tags)
+            if name not in names:
+                names.append(name)
+        id_ = next((value for name, value in attrs if name == 'id'), None) or ''
+        if id_ and id_ not in self.ids:
+            self.ids.append(id_)
+        self.attributes[id_] = [name for name in names if name != 'id']
+
+    def handle_starttag(self, tag, attrs):
+        self.record(tag, attrs)
+        if tag not in _VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.record(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in self.open_tags:
+            while self.open_tags.pop() != tag:
+                pass
+
+
+def get_manifest(html, css):
+    """Returns the structure of a sample as MetaMut.load_state expects it.
+
+    Args:
+      html: The generated body elements.
+      css: The generated style rules, one rule per line.
+    Returns:
+      A dict with the ids, attribute names per id and number of CSS rules.
+    """
+    parser = StructureParser()
+    parser.feed(html)
+    parser.close()
+    return {
+        'ids': parser.ids,
+        'attributes': parser.attributes,
+        'css_length': len([line for line in css.split('\n') if line.strip()])
+    }
+
+
 def check_grammar(grammar):
     """Checks if grammar has errors and if so outputs them.
     Args:
@@ -84,12 +153,13 @@ def check_grammar(grammar):
                 print('No creators for type ' + tagname)
 
 
-def generate_new_sample(template, htmlgrammar, cssgrammar):
+def generate_new_sample(template, htmlgrammar, cssgrammar, manifest=None):
     """Parses grammar rules from string.
     Args:
       template: A template string.
       htmlgrammar: Grammar for generating HTML code.
       cssgrammar: Grammar for generating CSS code.
+      manifest: If given, a dict updated with the structure of the sample.
     Returns:
       A string containing sample data.
     """
@@ -113,15 +183,71 @@ def generate_new_sample(template, htmlgrammar, cssgrammar):
     )
     generate_html_elements(htmlctx, _N_ADDITIONAL_HTMLVARS)
 
+    if manifest is not None:
+        manifest.update(get_manifest(html, css))
+
     result = result.replace('<cssfuzzer>', css)
     result = result.replace('<htmlfuzzer>', html)
     return result
 
-def generate_samples(template, outfiles):
-    """Generates a set of samples and writes them to the output files.
+def generate_seeded_sample(template, htmlgrammar, cssgrammar, seed, manifest=None):
+    """Generates the sample determined by a seed.
     Args:
-      grammar_dir: directory to load grammar files from.
-      outfiles: A list of output filenames.
+      template: A template string.
+      htmlgrammar: Grammar for generating HTML code.
+      cssgrammar: Grammar for generating CSS code.
+      seed: Seed of the random generator and of the grammar sampler, the
+        same seed and grammars always give the same sample.
+      manifest: If given, a dict updated with the structure of the sample.
+    Returns:
+      A string containing sample data.
+    """
+
+    random.seed(seed)
+    # cssgrammar is imported by htmlgrammar and shares its sampler
+    htmlgrammar.seed(seed, _SEEDED_BLOCK_SIZE)
+    return generate_new_sample(template, htmlgrammar, cssgrammar, manifest)
+
+def grammar_hash():
+    """Hashes everything a seeded sample depends on.
+    Returns:
+      A hex digest of the grammar rules, the template and the generator code.
+    """
+
+    fuzzer_dir = os.path.dirname(os.path.abspath(__file__))
+    rules = sorted(os.listdir(os.path.join(fuzzer_dir, 'rules')))
+    files = [os.path.join('rules', name) for name in rules]
+    files += ['template.html', 'grammar.py', 'generator.py',
+              'html_tags.py', 'svg_tags.py', 'mathml_tags.py']
+
+    h = hashlib.sha1()
+    # NumPy and random.Random samplers give different samples
+    h.update(BlockSampler.stream.encode())
+    for filename in files:
+        with open(os.path.join(fuzzer_dir, filename), 'rb') as f:
+            h.update(filename.encode())
+            h.update(f.read())
+    return h.hexdigest()
+
+def write_seed_corpus(corpus_file, seeds):
+    """Records samples by their seeds instead of writing them.
+    Args:
+      corpus_file: Output filename. The first line holds the grammar hash,
+        every following line one seed.
+      seeds: Seeds of the samples, see generate_seeded_sample.
+    """
+
+    with open(corpus_file, 'w') as f:
+        f.write('grammar ' + grammar_hash() + '\n')
+        for seed in seeds:
+            f.write('%d\n' % seed)
+
+def setup_grammars():
+    """Parses and compiles the HTML and CSS grammars.
+    Compiled grammars are cached in GRAMMAR_CACHE (a private directory,
+    ~/.cache/metamong by default), set it to 'off' to interpret the grammars.
+    Returns:
+      A (htmlgrammar, cssgrammar) tuple, or None if parsing failed.
     """
 
     grammar_dir = os.path.join(os.path.dirname(__file__), 'rules')
@@ -144,8 +270,30 @@ def generate_samples(template, outfiles):
     # Add it as import
     htmlgrammar.add_import('cssgrammar', cssgrammar)
 
+    cache_dir = os.environ.get('GRAMMAR_CACHE')
+    if cache_dir != 'off':
+        htmlgrammar.compile(cache_dir)
+    return htmlgrammar, cssgrammar
+
+def generate_samples(template, outfiles, manifest_file=None):
+    """Generates a set of samples and writes them to the output files.
+    Args:
+      template: A template string.
+      outfiles: A list of output filenames.
+      manifest_file: If given, a JSONL file to which the structure of every
+        written sample is appended, one line per sample keyed by file name.
+    """
+
+    grammars = setup_grammars()
+    if not grammars:
+        return
+    htmlgrammar, cssgrammar = grammars
+
+    manifest_fp = open(manifest_file, 'w') if manifest_file else None
+
     for outfile in outfiles:
-        result = generate_new_sample(template, htmlgrammar, cssgrammar)
+        manifest = {'file': os.path.basename(outfile)}
+        result = generate_new_sample(template, htmlgrammar, cssgrammar, manifest)
         if result is not None:
             print('Writing a sample to ' + outfile)
             try:
@@ -153,6 +301,13 @@ def generate_samples(template, outfiles):
                     f.write(result)
             except IOError:
                 print('Error writing to output')
+                continue
+            if manifest_fp:
+                manifest_fp.write(json.dumps(manifest) + '\n')
+                manifest_fp.flush()
+
+    if manifest_fp:
+        manifest_fp.close()
 
 def get_argument_parser():
     
@@ -167,6 +322,12 @@ def get_argument_parser():
     parser.add_argument('-n', '--no_of_files', type=int,
                     help='number of files to be generated')
 
+    parser.add_argument('--seeds', action='store_true',
+                    help='Record the seed of every sample in corpus-N.seeds instead of writing files')
+
+    parser.add_argument('--seed', type=int, default=0,
+                    help='First seed of a seed corpus')
+
     return parser
 
 def main(index):
@@ -194,13 +355,20 @@ def main(index):
             print('Number of samples: ' + str(nsamples))
 
             if not os.path.exists(out_dir):
-                os.mkdir(out_dir)
+                os.makedirs(out_dir, exist_ok=True)
+
+            if args.seeds:
+                first = args.seed + index * nsamples
+                corpus_file = os.path.join(out_dir, f'corpus-{index}.seeds')
+                write_seed_corpus(corpus_file, range(first, first + nsamples))
+                return
 
             outfiles = []
             for i in range(nsamples):
                 outfiles.append(os.path.join(out_dir, f'{index}-{str(i).zfill(7)}.html'))
-            
-            generate_samples(template, outfiles)
+
+            manifest_file = os.path.join(out_dir, f'manifest-{index}.jsonl')
+            generate_samples(template, outfiles, manifest_file)
                 
 
     else:
@@ -20,6 +20,9 @@
 from __future__ import print_function
 
 import bisect
+import hashlib
+import json
+import marshal
 try:
     from html import escape as _escape
 except ImportError:
@@ -27,7 +30,15 @@ except ImportError:
 import os
 import random
 import re
+import stat
 import struct
+import sys
+import tempfile
+import types
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 _INT_RANGES = {
     'int': [-2147483648, 2147483647],
@@ -77,6 +88,198 @@ class RecursionError(Error):
     pass
 
 
+# Operations of a compiled rule part, see Grammar._compile_rule.
+_OP_TEXT = 0
+_OP_BUILTIN = 1
+_OP_CALL = 2
+_OP_ANY = 3
+_OP_NEW = 4
+_OP_SYMBOL = 5
+
+
+def private_cache_dir(cache_dir=None):
+    """Returns a directory cached grammars can be loaded from.
+
+    Cached grammars are code, so the directory (~/.cache/metamong by
+    default) must belong to the current user and nobody else may write it.
+    It is created with mode 0700.
+
+    Args:
+      cache_dir: The directory, None for the default one.
+    Returns:
+      The directory, or None if it is not private and nothing is cached.
+    """
+    if cache_dir is None:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+            os.path.expanduser('~'), '.cache')
+        cache_dir = os.path.join(base, 'metamong')
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        if not _is_private(os.stat(cache_dir)):
+            print('Grammar cache %s is not private, not used' % cache_dir)
+            return None
+    except OSError:
+        return None
+    return cache_dir
+
+
+def open_cached(filename):
+    """Opens a cache file for reading, it must be private like its directory.
+
+    Raises:
+      OSError: The file does not exist or is not private.
+    """
+    fd = os.open(filename, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+    f = os.fdopen(fd, 'rb')
+    if not _is_private(os.fstat(fd)):
+        f.close()
+        raise OSError('%s is not private' % filename)
+    return f
+
+
+def _is_private(st):
+    return (st.st_uid == os.getuid() and
+            not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+
+def _randbelow(n):
+    """Same draw as random.randint(0, n - 1) without its call overhead.
+
+    Mirrors CPython's Random._randbelow_with_getrandbits, so it consumes
+    the same random bits.
+    """
+    k = n.bit_length()
+    r = random.getrandbits(k)
+    while r >= n:
+        r = random.getrandbits(k)
+    return r
+
+
+class _RandomSampler(object):
+    """Draws every random decision from the global random module.
+
+    This is the default sampler of a Grammar: samples only depend on
+    random.seed().
+    """
+
+    def __init__(self):
+        self.random = random.random
+        self.randint = random.randint
+        self.choice = random.choice
+
+    def choose(self, creators, cdf):
+        """Selects a creator according to the cdf, see _select_creator."""
+        if not cdf:
+            # Uniform distribution, faster
+            return creators[_randbelow(len(creators))]
+        return creators[bisect.bisect_left(cdf, random.random(), 0, len(cdf))]
+
+
+class BlockSampler(object):
+    """Serves random decisions from pre-sampled blocks of uniform numbers.
+
+    Numbers are drawn in blocks of block_size from a NumPy generator, or
+    one by one from a random.Random instance if NumPy is not available, so
+    the same seed gives the same decisions but the two streams differ.
+    Creators with a cdf are selected with alias tables built on first use,
+    every decision takes one number from the stream.
+    """
+
+    stream = 'numpy' if numpy is not None else 'random'
+
+    def __init__(self, seed=None, block_size=65536):
+        self.block_size = block_size
+        # id of a cdf -> its (probabilities, aliases) table
+        self._alias_tables = {}
+        self.reseed(seed)
+
+    def reseed(self, seed=None):
+        """Restarts the stream from a seed, the alias tables are kept."""
+        if numpy is not None:
+            self.random = self._blocks(numpy.random.default_rng(seed)).__next__
+        else:
+            self.random = random.Random(seed).random
+
+    def _blocks(self, rng):
+        while True:
+            for u in rng.random(self.block_size).tolist():
+                yield u
+
+    def randint(self, a, b):
+        """Returns an int in [a, b]."""
+        n = b - a + 1
+        if n <= 0x100000000:
+            return a + int(self.random() * n)
+        # A float only has 53 random bits, wide ranges (64 bit integers)
+        # are built from 32 bit chunks.
+        r = 0
+        for _ in range(n.bit_length() // 32 + 2):
+            r = (r << 32) | int(self.random() * 0x100000000)
+        return a + r % n
+
+    def choice(self, seq):
+        return seq[int(self.random() * len(seq))]
+
+    def _alias_table(self, cdf):
+        """Builds the alias table of a cdf (Vose's method)."""
+        k = len(cdf)
+        total = cdf[-1]
+        scaled = [(cdf[i] - (cdf[i - 1] if i else 0)) * k / total
+                  for i in range(k)]
+        probabilities = [1.0] * k
+        aliases = list(range(k))
+        small = [i for i in range(k) if scaled[i] < 1.0]
+        large = [i for i in range(k) if scaled[i] >= 1.0]
+        while small and large:
+            i = small.pop()
+            j = large.pop()
+            probabilities[i] = scaled[i]
+            aliases[i] = j
+            scaled[j] -= 1.0 - scaled[i]
+            if scaled[j] < 1.0:
+                small.append(j)
+            else:
+                large.append(j)
+        return probabilities, aliases
+
+    def choose(self, creators, cdf):
+        """Selects a creator according to the cdf, see _select_creator."""
+        if not cdf:
+            return creators[int(self.random() * len(creators))]
+        table = self._alias_tables.get(id(cdf))
+        if table is None:
+            table = self._alias_table(cdf)
+            self._alias_tables[id(cdf)] = table
+        probabilities, aliases = table
+        u = self.random() * len(probabilities)
+        i = int(u)
+        if u - i < probabilities[i]:
+            return creators[i]
+        return creators[aliases[i]]
+
+
+class _Frame(object):
+    """Pending expansion of a rule on the explicit expansion stack."""
+
+    __slots__ = ('symbol', 'rule', 'ops', 'depth', 'force', 'index',
+                 'retry', 'ret_parts', 'variable_ids', 'new_vars', 'ret_vars')
+
+    def __init__(self, symbol, rule, ops, depth, force):
+        self.symbol = symbol
+        self.rule = rule
+        self.ops = ops
+        self.depth = depth
+        self.force = force
+        # Index of the part being expanded and whether that part is
+        # being retried with only non-recursive creators.
+        self.index = 0
+        self.retry = False
+        self.ret_parts = []
+        self.variable_ids = {}
+        self.new_vars = []
+        self.ret_vars = []
+
+
 class Grammar(object):
     """Parses grammar and generates corresponding languages.
 
@@ -119,6 +322,17 @@ class Grammar(object):
 
         self._cssgrammar = None
 
+        # Expand with an explicit stack instead of recursive calls. Both
+        # engines consume random numbers in the same order and produce
+        # identical output.
+        self._iterative = True
+        # id of a rule -> its compiled parts, filled lazily by _compile_rule.
+        self._compiled_rules = {}
+        # Source of the random decisions, see seed().
+        self._sampler = _RandomSampler()
+        # Module of the compiled grammar, see compile().
+        self._compiled = None
+
         # Helper dictionaries for creating built-in types.
         self._constant_types = {
             'lt': '<',
@@ -161,6 +375,30 @@ class Grammar(object):
             'extends': self._set_extends
         }
 
+    def __getstate__(self):
+        """Returns the parsed state for pickling.
+
+        The helper dictionaries hold bound methods and are rebuilt by
+        __setstate__; compiled user-defined functions are marshalled.
+        """
+        state = self.__dict__.copy()
+        for key in ('_constant_types', '_built_in_types', '_command_handlers',
+                    '_compiled_rules', '_sampler', '_compiled'):
+            state.pop(key)
+        state['_functions'] = {
+            name: marshal.dumps(code) for name, code in self._functions.items()
+        }
+        return state
+
+    def __setstate__(self, state):
+        self.__init__()
+        state = state.copy()
+        functions = state.pop('_functions')
+        self.__dict__.update(state)
+        self._functions = {
+            name: marshal.loads(code) for name, code in functions.items()
+        }
+
     def _string_to_int(self, s):
         return int(s, 0)
 
@@ -180,7 +418,7 @@ class Grammar(object):
         if min_value > max_value:
             raise GrammarError('Range error in integer tag')
 
-        i = random.randint(min_value, max_value)
+        i = self._sampler.randint(min_value, max_value)
 
         if 'b' in tag or 'be' in tag:
             if 'be' in tag:
@@ -197,7 +435,7 @@ class Grammar(object):
         max_value = float(tag.get('max', '1'))
         if min_value > max_value:
             raise GrammarError('Range error in a float tag')
-        f = min_value + random.random() * (max_value - min_value)
+        f = min_value + self._sampler.random() * (max_value - min_value)
         if 'b' in tag:
             if tag['tagname'] == 'float':
                 return struct.pack('f', f)
@@ -215,7 +453,7 @@ class Grammar(object):
         max_value = self._string_to_int(tag.get('max', '255'))
         if min_value > max_value:
             raise GrammarError('Range error in char tag')
-        return chr(random.randint(min_value, max_value))
+        return chr(self._sampler.randint(min_value, max_value))
 
     def _generate_string(self, tag):
         """Generates a random string."""
@@ -225,9 +463,10 @@ class Grammar(object):
             raise GrammarError('Range error in string tag')
         minlen = self._string_to_int(tag.get('minlength', '0'))
         maxlen = self._string_to_int(tag.get('maxlength', '20'))
-        length = random.randint(minlen, maxlen)
+        length = self._sampler.randint(minlen, maxlen)
         charset = range(min_value, max_value + 1)
-        ret_list = [chr(charset[int(random.random() * len(charset))])
+        rand = self._sampler.random
+        ret_list = [chr(charset[int(rand() * len(charset))])
                     for _ in range(length)]
         return ''.join(ret_list)
 
@@ -236,7 +475,7 @@ class Grammar(object):
 
     def _generate_hex(self, tag):
         """Generates a single hex digit."""
-        digit = random.randint(0, 15)
+        digit = self._sampler.randint(0, 15)
         if 'up' in tag:
             return '%X' % digit
         else:
@@ -285,13 +524,17 @@ class Grammar(object):
         while len(context['lines']) < num_lines:
             tmp_context = context.copy()
             try:
-                if (random.random() < self._interesting_line_prob) and (len(tmp_context['interesting_lines']) > 0):
+                if (self._sampler.random() < self._interesting_line_prob) and (len(tmp_context['interesting_lines']) > 0):
                     tmp_context['force_var_reuse'] = True
-                    lineno = random.choice(tmp_context['interesting_lines'])
+                    lineno = self._sampler.choice(tmp_context['interesting_lines'])
                 else:
-                    lineno = random.choice(self._all_nonhelper_lines)
+                    lineno = self._sampler.choice(self._all_nonhelper_lines)
                 creator = self._creators['line'][lineno]
-                self._expand_rule('line', creator, tmp_context, 0, False)
+                if self._iterative:
+                    ops = self._compile_rule(creator)[0]
+                    self._expand_frame(_Frame('line', creator, ops, 0, False), tmp_context)
+                else:
+                    self._expand_rule('line', creator, tmp_context, 0, False)
                 context = tmp_context
             except RecursionError as e:
                 print('Warning: ' + str(e))
@@ -356,13 +599,8 @@ class Grammar(object):
             creators = self._creators[symbol]
             cdf = self._creator_cdfs[symbol]
 
-        if not cdf:
-            # Uniform distribution, faster
-            return creators[random.randint(0, len(creators) - 1)]
-
-        # Select a creator according to the cdf
-        idx = bisect.bisect_left(cdf, random.random(), 0, len(cdf))
-        return creators[idx]
+        # Select a creator according to the cdf, or uniformly if there is none
+        return self._sampler.choose(creators, cdf)
 
     def _generate(self, symbol, context,
                   recursion_depth=0, force_nonrecursive=False):
@@ -403,12 +641,12 @@ class Grammar(object):
                 symbol not in _NONINTERESTING_TYPES):
             # print symbol + ':' + str(len(context['variables'][symbol])) + ':' + str(force_var_reuse)
             if (force_var_reuse or
-                    random.random() < self._var_reuse_prob or
+                    self._sampler.random() < self._var_reuse_prob or
                     len(context['variables'][symbol]) > self._max_vars_of_same_type):
                 # print 'reusing existing var of type ' + symbol
                 context['force_var_reuse'] = False
                 variables = context['variables'][symbol]
-                return variables[random.randint(0, len(variables) - 1)]
+                return variables[self._sampler.randint(0, len(variables) - 1)]
                 # print 'Not reusing existing var of type ' + symbol
 
         creator = self._select_creator(
@@ -544,7 +782,565 @@ class Grammar(object):
             if symbol == 'line':
                 return filed_rule
             else:
-                return ret_vars[random.randint(0, len(ret_vars) - 1)]
+                return ret_vars[self._sampler.randint(0, len(ret_vars) - 1)]
+
+    def _compile_rule(self, rule):
+        """Resolves the parts of a rule into operations for _expand_frame.
+
+        Every operation is a (op, arg, id, beforeoutput, part) tuple, where
+        arg is the text of _OP_TEXT, the function of _OP_BUILTIN and
+        _OP_CALL, and the tag name otherwise. Constants are text.
+
+        Returns:
+            An (operations, leaf, text) tuple, leaf grammar rules never
+            expand another symbol and are expanded without a frame. text
+            is the expansion of a leaf rule that is only text, else None.
+        """
+        compiled = self._compiled_rules.get(id(rule))
+        if compiled is not None:
+            return compiled
+
+        ops = []
+        leaf = rule['type'] == 'grammar'
+        for part in rule['parts']:
+            if part['type'] == 'text':
+                op = (_OP_TEXT, part['text'])
+            elif rule['type'] == 'code' and 'new' in part:
+                op = (_OP_NEW, part['tagname'])
+            elif part['tagname'] in self._constant_types:
+                op = (_OP_TEXT, self._constant_types[part['tagname']])
+            elif part['tagname'] in self._built_in_types:
+                op = (_OP_BUILTIN, self._built_in_types[part['tagname']])
+            elif part['tagname'] == 'call':
+                op = (_OP_CALL, part.get('function'))
+            elif part['tagname'] == 'any':
+                op = (_OP_ANY, 'any')
+                leaf = False
+            else:
+                op = (_OP_SYMBOL, part['tagname'])
+                leaf = False
+            ops.append(op + (part.get('id'), part.get('beforeoutput'), part))
+
+        text = None
+        if leaf and all(op[0] == _OP_TEXT and op[3] is None for op in ops):
+            text = ''.join(op[1] for op in ops)
+
+        compiled = (ops, leaf, text)
+        self._compiled_rules[id(rule)] = compiled
+        return compiled
+
+    def _open(self, symbol, context, recursion_depth, force_nonrecursive):
+        """Starts the expansion of a symbol, see _generate.
+
+        Returns:
+            Either a string, when an existing variable is reused or the
+            selected rule is a leaf, or a _Frame for the selected rule.
+
+        Raises:
+            GrammarError: If there are no rules that create a given type.
+            RecursionError: If maximum recursion level was reached.
+        """
+
+        force_var_reuse = context['force_var_reuse']
+
+        if (symbol in context['variables'] and
+                symbol not in _NONINTERESTING_TYPES):
+            if (force_var_reuse or
+                    self._sampler.random() < self._var_reuse_prob or
+                    len(context['variables'][symbol]) > self._max_vars_of_same_type):
+                context['force_var_reuse'] = False
+                variables = context['variables'][symbol]
+                return variables[self._sampler.randint(0, len(variables) - 1)]
+
+        # Same as _select_creator
+        if symbol not in self._creators:
+            raise GrammarError('No creators for type ' + symbol)
+
+        if recursion_depth >= self._recursion_max:
+            raise RecursionError(
+                'Maximum recursion level reached while creating '
+                'object of type' + symbol
+            )
+        elif force_nonrecursive and symbol in self._nonrecursive_creators:
+            creators = self._nonrecursive_creators[symbol]
+            cdf = self._nonrecursivecreator_cdfs[symbol]
+        else:
+            creators = self._creators[symbol]
+            cdf = self._creator_cdfs[symbol]
+
+        creator = self._sampler.choose(creators, cdf)
+
+        compiled = self._compiled_rules.get(id(creator))
+        if compiled is None:
+            compiled = self._compile_rule(creator)
+        ops, leaf, text = compiled
+        if text is not None:
+            return text
+        if leaf:
+            return self._expand_leaf(ops, context)
+        return _Frame(symbol, creator, ops, recursion_depth, force_nonrecursive)
+
+    def _expand_leaf(self, ops, context):
+        """Same as _expand_rule for a rule without nonterminals."""
+        variable_ids = {}
+        ret_parts = []
+        for op, arg, part_id, beforeoutput, part in ops:
+            if part_id is not None and part_id in variable_ids:
+                ret_parts.append(variable_ids[part_id])
+                continue
+
+            if op == _OP_TEXT:
+                expanded = arg
+            elif op == _OP_BUILTIN:
+                expanded = arg(part)
+            else:
+                if arg is None:
+                    raise GrammarError('Call tag without a function attribute')
+                expanded = self._exec_function(arg, part, context, '')
+
+            if part_id is not None:
+                variable_ids[part_id] = expanded
+            if beforeoutput is not None:
+                expanded = self._exec_function(beforeoutput, part, context, expanded)
+            ret_parts.append(expanded)
+        return ''.join(ret_parts)
+
+    def _finish_part(self, frame, expanded, context):
+        """Stores the expansion of the current part of a frame."""
+        op, arg, part_id, beforeoutput, part = frame.ops[frame.index]
+        if part_id is not None:
+            frame.variable_ids[part_id] = expanded
+        if beforeoutput is not None:
+            expanded = self._exec_function(beforeoutput, part, context, expanded)
+        frame.ret_parts.append(expanded)
+        frame.index += 1
+
+    def _close(self, frame, context):
+        """Returns the expansion of a fully expanded frame, see _expand_rule."""
+        additional_lines = []
+        for v in frame.new_vars:
+            if v['type'] not in _NONINTERESTING_TYPES:
+                self._add_variable(v['name'], v['type'], context)
+                additional_lines.append("if (!" + v['name'] + ") { " + v['name'] + " = GetVariable(fuzzervars, '" + v['type'] + "'); } else { " + self._get_variable_setters(v['name'], v['type']) + " }")
+
+        filed_rule = ''.join(frame.ret_parts)
+        if frame.rule['type'] == 'grammar':
+            return filed_rule
+        else:
+            context['lines'].append(filed_rule)
+            context['lines'].extend(additional_lines)
+            if frame.symbol == 'line':
+                return filed_rule
+            else:
+                return frame.ret_vars[self._sampler.randint(0, len(frame.ret_vars) - 1)]
+
+    def _expand_frame(self, frame, context):
+        """Expands a rule with an explicit stack instead of recursion.
+
+        Same as _expand_rule: random numbers are consumed in the same order,
+        so both engines generate the same output. The parts of the frame
+        being expanded live in local variables, a nonterminal pushes the
+        frame on the stack and continues with the frame of its rule.
+
+        Args:
+            frame: The _Frame of the rule.
+            context: The context, see _generate.
+
+        Returns:
+            A string containing the expansion of the rule.
+
+        Raises:
+            GrammarError: If grammar description is incorrect causing
+                some rules being impossible to resolve
+            RecursionError: If maximum recursion level was reached.
+        """
+        stack = []
+        ops = frame.ops
+        n = len(ops)
+        ret_parts = frame.ret_parts
+        variable_ids = frame.variable_ids
+        i = 0
+        while True:
+            try:
+                if i < n:
+                    op, arg, part_id, beforeoutput, part = ops[i]
+                    if part_id is not None and part_id in variable_ids:
+                        ret_parts.append(variable_ids[part_id])
+                        i += 1
+                        continue
+
+                    if op == _OP_TEXT:
+                        expanded = arg
+                    elif op == _OP_SYMBOL or (op == _OP_ANY and 'variables' not in context):
+                        frame.retry = False
+                        try:
+                            expanded = self._open(arg, context, frame.depth + 1, frame.force)
+                        except RecursionError as e:
+                            if frame.force:
+                                raise RecursionError(e)
+                            frame.retry = True
+                            expanded = self._open(arg, context, frame.depth + 1, True)
+                        if expanded.__class__ is _Frame:
+                            frame.index = i
+                            stack.append(frame)
+                            frame = expanded
+                            ops = frame.ops
+                            n = len(ops)
+                            ret_parts = frame.ret_parts
+                            variable_ids = frame.variable_ids
+                            i = 0
+                            continue
+                    elif op == _OP_BUILTIN:
+                        expanded = arg(part)
+                    elif op == _OP_ANY:
+                        expanded = self._get_any_var(context)
+                    elif op == _OP_CALL:
+                        if arg is None:
+                            raise GrammarError('Call tag without a function attribute')
+                        expanded = self._exec_function(arg, part, context, '')
+                    else:
+                        context['lastvar'] += 1
+                        var_name = self._var_format % context['lastvar']
+                        frame.new_vars.append({'name': var_name, 'type': arg})
+                        if arg == frame.symbol:
+                            frame.ret_vars.append(var_name)
+                        expanded = '/* newvar{' + var_name + ':' + arg + '} */ var ' + var_name
+                else:
+                    # The frame is done, continue with the part of the
+                    # parent it expands.
+                    expanded = self._close(frame, context)
+                    if not stack:
+                        return expanded
+                    frame = stack.pop()
+                    ops = frame.ops
+                    n = len(ops)
+                    ret_parts = frame.ret_parts
+                    variable_ids = frame.variable_ids
+                    i = frame.index
+                    op, arg, part_id, beforeoutput, part = ops[i]
+
+                if part_id is not None:
+                    variable_ids[part_id] = expanded
+                if beforeoutput is not None:
+                    expanded = self._exec_function(beforeoutput, part, context, expanded)
+                ret_parts.append(expanded)
+                i += 1
+            except RecursionError as e:
+                frame = self._unwind(stack, context, e)
+                ops = frame.ops
+                n = len(ops)
+                ret_parts = frame.ret_parts
+                variable_ids = frame.variable_ids
+                i = frame.index
+
+    def _unwind(self, stack, context, error):
+        """Handles a RecursionError of the frame above the stack.
+
+        Like the recursive engine, the nearest parent that has not yet
+        retried its current part retries it with only non-recursive
+        creators; the others fail as well.
+
+        Returns:
+            The _Frame to continue with.
+
+        Raises:
+            RecursionError: If no parent can retry.
+        """
+        while stack:
+            frame = stack.pop()
+            if frame.force or frame.retry:
+                continue
+            frame.retry = True
+            try:
+                expanded = self._open(
+                    frame.ops[frame.index][1],
+                    context,
+                    frame.depth + 1,
+                    True
+                )
+                if expanded.__class__ is _Frame:
+                    stack.append(frame)
+                    return expanded
+                self._finish_part(frame, expanded, context)
+            except RecursionError as e:
+                error = e
+                continue
+            return frame
+        raise error
+
+    def _generate_iterative(self, symbol, context,
+                            recursion_depth=0, force_nonrecursive=False):
+        """Same as _generate, expanding with an explicit stack."""
+        expanded = self._open(symbol, context, recursion_depth, force_nonrecursive)
+        if expanded.__class__ is not _Frame:
+            return expanded
+        return self._expand_frame(expanded, context)
+
+    def seed(self, seed=None, block_size=65536):
+        """Draws the random decisions from a seeded BlockSampler.
+
+        Imported grammars share the sampler, so the output of the grammar
+        only depends on the seed. Without seed() the decisions come from
+        the global random module.
+
+        Args:
+            seed: Seed of the sampler.
+            block_size: Number of random numbers drawn at once.
+        """
+        if (isinstance(self._sampler, BlockSampler) and
+                self._sampler.block_size == block_size):
+            self._sampler.reseed(seed)
+        else:
+            self._set_sampler(BlockSampler(seed, block_size))
+
+    def _set_sampler(self, sampler):
+        self._sampler = sampler
+        for grammar in self._imports.values():
+            if grammar._sampler is not sampler:
+                grammar._set_sampler(sampler)
+
+    def compile(self, cache_dir=None):
+        """Compiles the grammar and its imports to Python functions.
+
+        Every symbol and every grammar rule becomes a function of a
+        generated module, so expanding a symbol no longer interprets the
+        rule dictionaries. Random numbers are consumed in the same order
+        as by the interpreter, the output does not change. Code rules are
+        still expanded by the interpreter.
+
+        The module source and its marshalled code are written to cache_dir
+        and reused while the grammar hash does not change. The directory
+        must be private, see private_cache_dir, otherwise nothing is cached.
+
+        Args:
+            cache_dir: Directory of the generated modules, None for
+              ~/.cache/metamong.
+        """
+        cache_dir = private_cache_dir(cache_dir)
+
+        name = 'domato_%s' % self._grammar_hash()
+        module_file = '<%s>' % name
+        code = None
+        if cache_dir:
+            module_file = os.path.join(cache_dir, name + '.py')
+            code_file = os.path.join(cache_dir, name + '.marshal')
+            try:
+                with open_cached(code_file) as f:
+                    code = marshal.load(f)
+            except (OSError, EOFError, ValueError, TypeError):
+                pass
+
+        if code is None:
+            source = self._compile_source()
+            code = compile(source, module_file, 'exec')
+            if cache_dir:
+                # Written to temporary files first, processes may race on them.
+                for filename, data in ((module_file, source.encode()),
+                                       (code_file, marshal.dumps(code))):
+                    fd, tmp_file = tempfile.mkstemp(dir=cache_dir)
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(data)
+                    os.replace(tmp_file, filename)
+
+        module = types.ModuleType(name)
+        module.__file__ = module_file
+        exec(code, module.__dict__)
+        module.bind(self, RecursionError, GrammarError)
+        self._compiled = module
+
+        for grammar in self._imports.values():
+            if grammar._compiled is None:
+                grammar.compile(cache_dir)
+
+    def _grammar_hash(self):
+        """Hashes everything the compiled module of the grammar depends on."""
+        # marshal data is specific to the Python version
+        h = hashlib.sha1(sys.version.encode())
+        with open(os.path.abspath(__file__), 'rb') as f:
+            h.update(f.read())
+        cdfs = [sorted(symbol for symbol, cdf in self._creator_cdfs.items() if cdf),
+                sorted(symbol for symbol, cdf in self._nonrecursivecreator_cdfs.items() if cdf)]
+        h.update(json.dumps(
+            [self._creators, self._nonrecursive_creators, cdfs],
+            sort_keys=True
+        ).encode())
+        return h.hexdigest()
+
+    def _compile_source(self):
+        """Generates the source of the compiled module, see compile().
+
+        Symbols become functions s_<n>(ctx, depth, force) that mirror
+        _generate and rules functions r_<n>(ctx, depth, force) that mirror
+        _expand_rule. Part dictionaries, cdfs and built-in types are bound
+        to the grammar instance by bind(), parts and code rules are
+        referenced by their position in the creators.
+        """
+        symbols = {}
+        for symbol in sorted(self._creators):
+            symbols[symbol] = 's_%d' % len(symbols)
+
+        def symbol_function(symbol):
+            if symbol not in symbols:
+                symbols[symbol] = 's_%d' % len(symbols)
+            return symbols[symbol]
+
+        parts = []
+        code_rules = []
+        builtins = {}
+        binds = []
+        functions = []
+        rule_functions = {}
+
+        def expand_symbol(lines, symbol, var):
+            function = symbol_function(symbol)
+            lines.append('    try:')
+            lines.append('        %s = %s(ctx, depth + 1, force)' % (var, function))
+            lines.append('    except RecursionError as e:')
+            lines.append('        if force:')
+            lines.append('            raise RecursionError(e)')
+            lines.append('        %s = %s(ctx, depth + 1, True)' % (var, function))
+
+        def compile_rule(symbol, index, rule):
+            name = 'r_%d' % len(rule_functions)
+            rule_functions[(symbol, id(rule))] = name
+            lines = ['def %s(ctx, depth, force):' % name]
+            if rule['type'] != 'grammar':
+                lines.append('    return G._expand_rule(%r, R[%d], ctx, depth, force)' %
+                             (symbol, len(code_rules)))
+                code_rules.append((symbol, index))
+                functions.append('\n'.join(lines))
+                return name
+
+            ids = {}
+            values = []
+            for part_index, part in enumerate(rule['parts']):
+                if 'id' in part and part['id'] in ids:
+                    values.append(ids[part['id']])
+                    continue
+
+                if part['type'] == 'text':
+                    values.append(repr(part['text']))
+                    continue
+
+                var = 'e%d' % len(values)
+                p = 'P[%d]' % len(parts)
+                parts.append((symbol, index, part_index))
+                tagname = part['tagname']
+                if tagname in self._constant_types:
+                    lines.append('    %s = %r' % (var, self._constant_types[tagname]))
+                elif tagname in self._built_in_types:
+                    if tagname not in builtins:
+                        builtins[tagname] = 'B%d' % len(builtins)
+                        binds.append('    %s = grammar._built_in_types[%r]' % (builtins[tagname], tagname))
+                    lines.append('    %s = %s(%s)' % (var, builtins[tagname], p))
+                elif tagname == 'call':
+                    if 'function' not in part:
+                        lines.append("    raise GrammarError('Call tag without a function attribute')")
+                        break
+                    lines.append("    %s = G._exec_function(%r, %s, ctx, '')" % (var, part['function'], p))
+                elif tagname == 'any':
+                    lines.append("    if 'variables' in ctx:")
+                    lines.append('        %s = G._get_any_var(ctx)' % var)
+                    lines.append('    else:')
+                    sub = []
+                    expand_symbol(sub, tagname, var)
+                    lines.extend('    ' + line for line in sub)
+                else:
+                    expand_symbol(lines, tagname, var)
+
+                if 'id' in part:
+                    ids[part['id']] = 'v_' + var
+                    lines.append('    v_%s = %s' % (var, var))
+                if 'beforeoutput' in part:
+                    lines.append('    %s = G._exec_function(%r, %s, ctx, %s)' %
+                                 (var, part['beforeoutput'], p, var))
+                values.append(var)
+            else:
+                if not values:
+                    lines.append("    return ''")
+                elif len(values) == 1:
+                    lines.append('    return %s' % values[0])
+                else:
+                    lines.append("    return ''.join((%s,))" % ', '.join(values))
+            functions.append('\n'.join(lines))
+            return name
+
+        tables = []
+        for symbol in sorted(self._creators):
+            function = symbols[symbol]
+            names = [compile_rule(symbol, index, rule)
+                     for index, rule in enumerate(self._creators[symbol])]
+            tables.append('T%s = (%s,)' % (function[1:], ', '.join(names)))
+            binds.append('    C%s = grammar._creator_cdfs[%r]' % (function[1:], symbol))
+            if symbol in self._nonrecursive_creators:
+                names = [rule_functions[(symbol, id(rule))]
+                         for rule in self._nonrecursive_creators[symbol]]
+                tables.append('N%s = (%s,)' % (function[1:], ', '.join(names)))
+                binds.append('    M%s = grammar._nonrecursivecreator_cdfs[%r]' % (function[1:], symbol))
+
+        # Symbol functions, including the symbols used without creators
+        for symbol, function in list(symbols.items()):
+            lines = ['def %s(ctx, depth, force):' % function]
+            if symbol not in _NONINTERESTING_TYPES:
+                lines.append("    if %r in ctx['variables']:" % symbol)
+                lines.append("        if (ctx['force_var_reuse'] or")
+                lines.append('                G._sampler.random() < G._var_reuse_prob or')
+                lines.append("                len(ctx['variables'][%r]) > G._max_vars_of_same_type):" % symbol)
+                lines.append("            ctx['force_var_reuse'] = False")
+                lines.append("            variables = ctx['variables'][%r]" % symbol)
+                lines.append('            return variables[G._sampler.randint(0, len(variables) - 1)]')
+            if symbol not in self._creators:
+                lines.append('    raise GrammarError(%r)' % ('No creators for type ' + symbol))
+            else:
+                lines.append('    if depth >= G._recursion_max:')
+                lines.append('        raise RecursionError(%r)' % (
+                    'Maximum recursion level reached while creating object of type' + symbol))
+                if symbol in self._nonrecursive_creators:
+                    lines.append('    if force:')
+                    lines.append('        return G._sampler.choose(N%s, M%s)(ctx, depth, force)' %
+                                 (function[1:], function[1:]))
+                lines.append('    return G._sampler.choose(T%s, C%s)(ctx, depth, force)' %
+                             (function[1:], function[1:]))
+            functions.append('\n'.join(lines))
+
+        globals_line = ', '.join(
+            ['G', 'P', 'R', 'RecursionError', 'GrammarError'] +
+            sorted(builtins.values()) +
+            sorted(line.split()[0] for line in binds if line.split()[0][0] in 'CM'))
+        source = [
+            '# Generated from a parsed domato grammar by Grammar.compile().',
+            '',
+            '',
+            'def bind(grammar, recursion_error, grammar_error):',
+            '    global ' + globals_line,
+            '    G = grammar',
+            "    P = [grammar._creators[s][r]['parts'][i] for s, r, i in PARTS]",
+            '    R = [grammar._creators[s][r] for s, r in CODE_RULES]',
+            '    RecursionError = recursion_error',
+            '    GrammarError = grammar_error',
+        ]
+        source.extend(binds)
+        source.append('')
+        source.append('')
+        source.append('def generate(symbol, ctx):')
+        source.append('    if symbol not in SYMBOLS:')
+        source.append("        raise GrammarError('No creators for type ' + symbol)")
+        source.append('    return SYMBOLS[symbol](ctx, 0, False)')
+        source.append('')
+        source.append('')
+        source.append('\n\n\n'.join(functions))
+        source.append('')
+        source.append('')
+        source.extend(tables)
+        source.append('')
+        source.append('PARTS = %r' % (tuple(parts),))
+        source.append('CODE_RULES = %r' % (tuple(code_rules),))
+        source.append('')
+        source.append('SYMBOLS = {')
+        for symbol in sorted(self._creators):
+            source.append('    %r: %s,' % (symbol, symbols[symbol]))
+        source.append('}')
+        return '\n'.join(source) + '\n'
 
     def generate_root(self):
         """Expands root symbol."""
@@ -555,6 +1351,10 @@ class Grammar(object):
                 'variables': {},
                 'force_var_reuse': False
             }
+            if self._compiled is not None:
+                return self._compiled.generate(self._root, context)
+            if self._iterative:
+                return self._generate_iterative(self._root, context, 0)
             return self._generate(self._root, context, 0)
         else:
             print('Error: No root element defined.')
@@ -568,6 +1368,10 @@ class Grammar(object):
             'variables': {},
             'force_var_reuse': False
         }
+        if self._compiled is not None:
+            return self._compiled.generate(name, context)
+        if self._iterative:
+            return self._generate_iterative(name, context, 0)
         return self._generate(name, context, 0)
 
     def _get_cdf(self, symbol, creators):
@@ -1028,6 +1832,6 @@ class Grammar(object):
         return ret
 
     def _get_any_var(self, context):
-        var_type = random.choice(list(context['variables'].keys()))
-        return random.choice(context['variables'][var_type])
+        var_type = self._sampler.choice(list(context['variables'].keys()))
+        return self._sampler.choice(context['variables'][var_type])
 
@@ -10,6 +10,7 @@ from threading import current_thread, get_native_id
 from utils.driver import Browser
 from utils.helper import IOQueue
 from utils.helper import FileManager
+from utils.analyzer import analyze_html
 
 from pyvirtualdisplay import Display
 
@@ -28,9 +29,13 @@ class Fuzzer(Thread):
         self.iter_num = 4
 
         self.__cross_version = False
+        self.__vdisplay = None
 
         self.meta_mut = MetaMut()
 
+        # ANALYZER=browser loads the testcase to collect its ids and rules
+        self.__static = environ.get('ANALYZER', 'static') != 'browser'
+
     def cross_version_mode(self) -> None:
         self.__cross_version = True
 
@@ -58,8 +63,16 @@ class Fuzzer(Thread):
         else:
             raise ValueError('Unsupported browser type')
 
+        pool = self.helper.pool
+        if pool:
+            for ver in vers:
+                br = pool.checkout(bt, ver, popup=True, vid=vid)
+                if not br: return False
+                self.br_list.append(br)
+            return True
+
         for ver in vers:
-            self.br_list.append(Browser(bt, ver, popup=True, vid_=vid))
+            self.br_list.append(Browser(bt, ver, popup=True, vid_=vid, server=self.helper.server))
 
         for br in self.br_list:
             if not br.setup_browser():
@@ -67,8 +80,12 @@ class Fuzzer(Thread):
         return True
 
     def stop_browsers(self) -> None:
+        pool = self.helper.pool
         for br in self.br_list:
-            br.kill_browser()
+            self.helper.record_settle(br.settle_stats)
+            br.settle_stats.clear()
+            if pool: pool.checkin(br)
+            else: br.kill_browser()
         self.br_list.clear()
 
     def __test_wrapper(self, br, html_file: str, muts: list, phash: bool = False):
@@ -79,18 +96,37 @@ class Fuzzer(Thread):
         return is_bug
 
     def gen_muts(self, html_file: str, muts: list):
-        br = self.get_newer_browser()
-        dic = br.analyze_html(html_file)
+        dic = self.helper.get_manifest(html_file)
+        if dic is None and self.__static:
+            dic = analyze_html(html_file, self.helper.read_testcase(html_file))
+        elif dic is None:
+            dic = self.get_newer_browser().analyze_html(html_file)
         if not dic: return
         self.meta_mut.load_state(dic)
         muts.extend(self.meta_mut.generate())
 
-    def test_html(self, html_file: str, muts: list, phash: bool = False):
+    def test_html(self, html_file: str, muts: list, phash: bool = False, use_cache: bool = True):
+        # use_cache=False runs the test anyway, e.g. to confirm a result
+        cache = self.helper.oracle_cache
+        key = None
+        if cache and not self.saveshot:
+            brs = self.br_list if self.__cross_version else self.br_list[-1:]
+            key = cache.key(self.helper.read_testcase(html_file), muts, [br.version for br in brs],
+                            (self.__btype, self.__cross_version, self.iter_num, phash))
+            is_bug = cache.get(key) if use_cache else None
+            if is_bug is not None: return is_bug
+
+        is_bug = self.__test_html(html_file, muts, phash)
+        if key: cache.put(key, is_bug)
+        return bool(is_bug)
+
+    def __test_html(self, html_file: str, muts: list, phash: bool = False):
+        # None if a run was inconclusive
         br = self.get_newer_browser()
         for _ in range(self.iter_num):
             is_bug = self.__test_wrapper(br, html_file, muts, phash=phash)
             if is_bug is not None: self.helper.count_valid_test()
-            if is_bug is None or not is_bug: return False
+            if is_bug is None or not is_bug: return is_bug
 
         # if not cross_version test mode, return true
         if not self.__cross_version: return True
@@ -99,23 +135,38 @@ class Fuzzer(Thread):
         old_br = self.get_older_browser()
         for _ in range(self.iter_num):
             is_bug = self.__test_wrapper(old_br, html_file, muts)
-            if is_bug is None or is_bug: return False
+            if is_bug is None: return
+            if is_bug: return False
 
         return True
 
-    def run(self) -> None:
+    def start_display(self) -> str:
+        # Pooled browsers keep running on the pool's display for this id.
+        if self.helper.pool:
+            self.__vdisplay = None
+            return self.helper.pool.get_display(self.__id)
 
-        cur_vers = None
-        hpr = self.helper
         if environ.get('DEBUG'):
             vdisplay = Display(size=(1600, 1200), backend="xvnc", rfbport=self.__id + 5900)
         else:
             vdisplay = Display(size=(1600, 1200))
         vdisplay.start()
-        env = vdisplay.new_display_var
+        self.__vdisplay = vdisplay
+        return vdisplay.new_display_var
+
+    def stop_display(self) -> None:
+        if self.__vdisplay:
+            self.__vdisplay.stop()
+
+    def run(self) -> None:
+
+        cur_vers = None
+        hpr = self.helper
+        env = self.start_display()
         try:
             while True:
-                popped = hpr.pop_from_queue()
+                popped = hpr.pop_from_queue(prefer=cur_vers)
+                if not popped and hpr.wait_for_input(): continue
                 if not popped: break
     
                 result, vers = popped
@@ -140,5 +191,5 @@ class Fuzzer(Thread):
                     hpr.update_postq(vers, html_file, muts)
 
         finally:
-            vdisplay.stop()
             self.stop_browsers()
+            self.stop_display()
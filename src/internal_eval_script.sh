@@ -8,7 +8,6 @@ BROWSER=$1
 
 INPUT_DIR=$2
 
-cp js/metamor.js /tmp 
 mkdir -p "internal_eval"
 
 for n in {1..2}
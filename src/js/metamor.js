@@ -508,7 +508,8 @@ window.DelCSS = class DelCSS {
             if (!sheet || num_rules <= 0) {
                 this.mutable = false; 
             } else {
-                const pos = ruleidx % num_rules;
+                // the offline css_length is an upper bound of cssRules.length
+                const pos = Math.min(ruleidx, num_rules - 1);
                 this.rule_text = sheet.rules[pos].cssText;
                 sheet.removeRule(pos)
                     this.rule_pos = pos;
@@ -2,29 +2,39 @@ import time
 import argparse
 
 from random import seed
-from datetime import timedelta
+from threading import Thread
 
 from fuzzer import Fuzzer
 from minimizer import Minimizer
 
-from os.path import join, dirname, basename
+from os.path import join, dirname, basename, abspath, exists
 from os import environ, _exit
+from pathlib import Path
 
 
+from utils.store import QueueStore
+from utils.source import GenerationSource
+from utils.corpus import load_corpora
+from utils.pipeline import Pipeline
 from utils.helper import FileManager, VersionManager, IOQueue
 
-class Metamong:
+class Metamong(Pipeline):
     def __init__(self, input_dir: str, output_dir: str, num_of_threads: int,
                  browser_type:str, base_version: int, target_version: int) -> None:
 
-        self.in_dir = input_dir
-        self.out_dir = output_dir
-        self.num_of_threads = num_of_threads
-        self.browser_type = browser_type
+        super().__init__(input_dir, output_dir, num_of_threads, browser_type)
         self.base_ver = base_version
         self.target_ver = target_version
+        self.kill_stragglers = True
+
+        # --store persists the queue to <output>/queue.db, --resume reopens it
+        self.store = False
+        self.resume = False
+
+        # --generate NUM tests NUM generated testcases (0: no end) instead
+        # of the input directory, only findings are kept on disk.
+        self.generate = None
 
-        self.experiment_result = {}
         self.tester = [
             Fuzzer,
             Minimizer,
@@ -37,60 +47,63 @@ class Metamong:
     def skip_minimizer(self):
         self.tester.remove(Minimizer)
 
-    def test_wrapper(self, test_class: object, report: bool = False) -> None:
-        start = time.time()
-        threads = []
-        for i in range(self.num_of_threads):
-            threads.append(test_class(i, self.ioq, self.browser_type))
-            threads[-1].saveshot = report
-
-        class_name = type(threads[-1]).__name__
-        print (f'{class_name} stage starts...')
-
-        for th in threads:
-            th.start()
-
-        num_th = len(threads)
-        alive = num_th
-        while True:
-            self.ioq.monitoring()
-            time.sleep(1)
-
-            alive = 0
-            for th in threads:
-                if th.is_alive(): alive += 1
-
-            if alive == 0: break
-
-            if alive < num_th:
-                left = self.ioq.left()
-                print (f'{alive} of {num_th} Threads are alive, {left} inputs are left...')
-                if left == 0:
-                    for th in threads:
-                        if not th.is_alive(): continue
-                        for br in th.br_list:
-                            br.kill_browser_by_pid()
-                    time.sleep(10)
-                    break
-
-
-        self.ioq.reset_lock()
-        elapsed = time.time() - start
-        elapsed_time = str(timedelta(seconds=elapsed))
-        print (f'{class_name} stage ends...', elapsed_time)
-
-        if not report:
-            self.experiment_result[class_name] = [self.ioq.num_of_outputs, elapsed_time]
-        self.ioq.move_to_preqs()
-        if not report:
-            dirname = class_name
-            dir_path = join(self.out_dir, dirname)
-            self.ioq.dump_queue(dir_path)
-
+    def feed(self, source: GenerationSource, rev_range: list, bound: int) -> None:
+        vers = (rev_range[0], rev_range[-1])
+        for html_file, manifest in source:
+            while self.ioq.left() >= bound:
+                time.sleep(0.1)
+            self.ioq.manifests[abspath(html_file)] = manifest
+            self.ioq.insert_to_queue(vers, html_file, [])
+        self.ioq.closed.set()
+
+    def start_generation(self, rev_range: list) -> GenerationSource:
+        spool = abspath(join(self.out_dir, 'spool'))
+        workers = int(environ.get('GEN_WORKERS', '2'))
+        bound = int(environ.get('GEN_QUEUE', 4 * self.num_of_threads))
+        source = GenerationSource(spool, int(environ.get('SEED', '0')), self.generate, workers, bound)
+        source.start()
+
+        self.ioq = IOQueue([], rev_range)
+        self.ioq.spool = spool
+        self.ioq.closed.clear()
+        Thread(target=self.feed, args=(source, rev_range, bound), daemon=True).start()
+        return source
+
+    def get_testcases(self):
+        # Paged into the IOQueue. Materialized findings of a corpus are
+        # already walked as files.
+        yield from FileManager.iter_files(self.in_dir, '.html', 'expected.html')
+        for testcase in self.corpus.paths():
+            if not exists(testcase): yield testcase
+
+    def open_store(self, rev_range: list) -> list:
+        # Returns the testers left to run.
+        Path(self.out_dir).mkdir(parents=True, exist_ok=True)
+        try:
+            store = QueueStore(join(self.out_dir, 'queue.db'), self.resume)
+        except ValueError as e:
+            print (e)
+            _exit(1)
+
+        if not self.resume:
+            testcases = self.get_testcases()
+            self.ioq = IOQueue(testcases, rev_range, store, self.corpus)
+            self.ioq.checkpoint(self.tester[0].__name__)
+            return self.tester
+
+        self.ioq = IOQueue([], rev_range, store, self.corpus)
+        tester = [test for test in self.tester if not store.is_completed(test.__name__)]
+        if tester:
+            self.ioq.restore(tester[0].__name__)
+        else:
+            self.ioq.restore(self.tester[-1].__name__)
+            self.ioq.move_to_preqs()
+            store.stage = 'Report'
+        return tester
 
     def process(self) -> None:
         start = time.time()
-        testcases = FileManager.get_all_files(self.in_dir, '.html', 'expected.html')
+        self.remove_stale_files()
 
         if self.browser_type == 'chrome':
             self.vm = VersionManager(self.browser_type)
@@ -98,45 +111,72 @@ class Metamong:
         elif self.browser_type == 'firefox':
             rev_range = [self.base_ver, self.target_ver]
 
-        num_of_tests = len(testcases)
+        self.corpus = load_corpora(self.in_dir, int(environ.get('CORPUS_WORKERS', '2')))
+
+        tester = self.tester
+        stream = environ.get('PIPELINE', 'stage') == 'stream'
+        if self.generate is not None and (self.store or self.resume):
+            print ('the queue store is not used for generated testcases')
+            self.store = self.resume = False
+        if stream and (self.store or self.resume):
+            print ('the queue store needs PIPELINE=stage, streaming is disabled')
+            stream = False
+        if self.generate == 0 and not stream and len(tester) > 1:
+            print ('--generate 0 never ends the Fuzzer stage, use PIPELINE=stream to minimize findings')
+
+        source = None
+        if self.generate is not None:
+            source = self.start_generation(rev_range)
+        elif self.store or self.resume:
+            tester = self.open_store(rev_range)
+        else:
+            self.ioq = IOQueue(self.get_testcases(), rev_range, corpus=self.corpus)
+
+        num_of_tests = self.ioq.num_of_inputs
+        if self.ioq.is_paging(): num_of_tests = f'{num_of_tests}+'
+        if source: num_of_tests = self.generate or 'unbounded'
         rev_a = rev_range[0]
         rev_b = rev_range[-1]
 
         print (f'# of tests: {num_of_tests}, rev_a: {rev_a}, rev_b: {rev_b}')
 
-        self.ioq = IOQueue(testcases, rev_range)
-
-        for test in self.tester: 
-            self.test_wrapper(test)
-
-        elapsed = time.time() - start
-        self.experiment_result['TOTAL TIME'] = str(timedelta(seconds=elapsed))
-
-        if self.report:
-            self.ioq.dump_queue_with_sort(join(self.out_dir, 'Report'))
-            for test in self.report: 
-                self.test_wrapper(test, True)
+        self.start_services(self.corpus, 2 * self.num_of_threads)
+        self.run(tester, stream, start)
 
+        if source: source.stop()
+        self.stop_services()
         print (self.experiment_result)
         _exit(0) 
         
 
 def main():
     parser = argparse.ArgumentParser(description='Usage')
-    parser.add_argument('-i', '--input', required=True, type=str, default='', help='input directory')
+    parser.add_argument('-i', '--input', required=False, type=str, default='', help='input directory')
     parser.add_argument('-o', '--output', required=True, type=str, help='output directory')
     parser.add_argument('-j', '--job', required=False, type=int, default=1, help='number of threads')
     parser.add_argument('-t', '--type', required=False, type=str, default='chrome', help='Browser type')
     parser.add_argument('-p', '--pre', required=True, type=int, help='Version of base Chrome (e.g., 80)')
     parser.add_argument('-n', '--new', required=True, type=int, help='version of target Chrome (e.g., 81)')
     parser.add_argument('--nomin', action='store_true',    help='No minimization')
+    parser.add_argument('--store', action='store_true',    help='Persist the queue to <output>/queue.db')
+    parser.add_argument('--resume', action='store_true',   help='Resume the run persisted in <output>/queue.db')
+    parser.add_argument('-g', '--generate', required=False, type=int, help='Generate this many testcases instead of -i (0: no end)')
     args = parser.parse_args()
+    if not args.input and args.generate is None:
+        parser.error('either -i or -g is required')
 
     seed(int(environ.get("SEED", "0")))
 
-    m = Metamong(args.input, args.output, args.job, args.type, args.pre, args.new)
+    input_dir = args.input
+    if args.generate is not None and not input_dir:
+        input_dir = join(args.output, 'spool')
+
+    m = Metamong(input_dir, args.output, args.job, args.type, args.pre, args.new)
     if args.nomin:
         m.skip_minimizer()
+    m.store = args.store
+    m.resume = args.resume
+    m.generate = args.generate
     m.process()
 
 
@@ -1,8 +1,6 @@
 import os
-import re
 import time
 
-from datetime import timedelta
 from pyvirtualdisplay import Display
 from os.path import basename, join, dirname
 
@@ -13,6 +11,10 @@ from helper import IOQueue
 from helper import ImageDiff
 from helper import FileManager
 from helper import VersionManager
+from pipeline import Pipeline
+from analyzer import analyze_html
+from corpus import load_corpora
+from reducer import Reducer
 
 from threading import Thread
 from threading import current_thread
@@ -21,8 +23,8 @@ from bisect import bisect
 
 from pathlib import Path
 from shutil import copyfile
-from bs4 import BeautifulSoup
 from collections import defaultdict
+from itertools import chain
 
 from mutater import MetaMut
 from multiprocessing import Process
@@ -34,11 +36,15 @@ class SingleVersion(Thread):
 
         self.helper = helper
         self.__btype = browser_type
+        self.browser_type = browser_type
 
         self.report_mode = False
         self.saveshot = False
         self.iter_num = 4
 
+        # ANALYZER=browser loads the testcase to collect its ids and rules
+        self.static = os.environ.get('ANALYZER', 'static') != 'browser'
+
 
     def report_mode(self) -> None:
         self.report_mode = True
@@ -61,8 +67,16 @@ class SingleVersion(Thread):
         else:
             raise ValueError('Unsupported browser type')
 
+        pool = self.helper.pool
+        if pool:
+            for ver in vers:
+                br = pool.checkout(bt, ver)
+                if not br: return False
+                self.br_list.append(br)
+            return True
+
         for ver in vers:
-            self.br_list.append(Browser(bt, ver))
+            self.br_list.append(Browser(bt, ver, server=self.helper.server))
 
         for br in self.br_list:
             if not br.setup_browser():
@@ -70,8 +84,12 @@ class SingleVersion(Thread):
         return True
 
     def stop_browsers(self) -> None:
+        pool = self.helper.pool
         for br in self.br_list:
-            br.kill_browser()
+            self.helper.record_settle(br.settle_stats)
+            br.settle_stats.clear()
+            if pool: pool.checkin(br)
+            else: br.kill_browser()
         self.br_list.clear()
 
     def test_wrapper(self, br, html_file: str, muts: list, phash: bool = False):
@@ -82,9 +100,12 @@ class SingleVersion(Thread):
         return is_bug
 
     def gen_muts(self, html_file: str, muts: list):
-        br = self.get_newer_browser()
         meta_mut = MetaMut()
-        dic = br.analyze_html(html_file)
+        dic = self.helper.get_manifest(html_file)
+        if dic is None and self.static:
+            dic = analyze_html(html_file, self.helper.read_testcase(html_file))
+        elif dic is None:
+            dic = self.get_newer_browser().analyze_html(html_file)
         if not dic: return
         meta_mut.load_state(dic)
         muts.extend(meta_mut.generate())
@@ -103,7 +124,8 @@ class SingleVersion(Thread):
 
         while True:
 
-            popped = hpr.pop_from_queue()
+            popped = hpr.pop_from_queue(prefer=cur_vers)
+            if not popped and hpr.wait_for_input(): continue
             if not popped: break
 
             result, vers = popped
@@ -118,7 +140,8 @@ class SingleVersion(Thread):
             # This is for eliminating non-invalidation bug.
             br = self.get_newer_browser()
             if self.test_wrapper(br, html_file, [], phash=True):
-                os.remove(html_file) 
+                # virtual corpus entries are never materialized
+                if os.path.exists(html_file): os.remove(html_file)
                 continue
 
             if not muts:
@@ -135,7 +158,25 @@ class CrossVersion(SingleVersion):
     def __init__(self, helper: IOQueue, browser_type: str) -> None:
         super().__init__(helper, browser_type)
 
-    def cross_version_test_html(self, html_file: str, muts: list) -> bool:
+    def oracle_key(self, vers: Tuple[int, int], html_file: str, muts: list) -> Optional[str]:
+        cache = self.helper.oracle_cache
+        if not cache or self.saveshot: return
+        return cache.key(self.helper.read_testcase(html_file), muts, vers,
+                         (self.browser_type, 'cross_version', self.iter_num))
+
+    def cross_version_test_html(self, html_file: str, muts: list, use_cache: bool = True) -> bool:
+        # use_cache=False runs the test anyway, e.g. to confirm a result
+        cache = self.helper.oracle_cache
+        key = self.oracle_key([br.version for br in self.br_list], html_file, muts)
+        if key and use_cache:
+            is_bug = cache.get(key)
+            if is_bug is not None: return is_bug
+
+        is_bug = self.run_cross_version_test(html_file, muts)
+        if key: cache.put(key, is_bug)
+        return is_bug
+
+    def run_cross_version_test(self, html_file: str, muts: list) -> bool:
         thread_id = current_thread()
         br1, br2 = self.br_list
 
@@ -156,7 +197,8 @@ class CrossVersion(SingleVersion):
 
         while True:
 
-            popped = hpr.pop_from_queue()
+            popped = hpr.pop_from_queue(prefer=cur_vers)
+            if not popped and hpr.wait_for_input(): continue
             if not popped: break
 
             result, vers = popped
@@ -185,13 +227,25 @@ class Bisecter(Thread):
         self.saveshot = False
         self.cur_mid = None
 
+        # BISECT=single pops one testcase at a time, BISECT=kary probes
+        # several revisions of an interval concurrently on idle threads.
+        self.mode = os.environ.get('BISECT', 'batch')
+
         self.build = False
 
     def cross_version_test(self, vers: Tuple[int, int], html_file: str, muts: list):
         cv = CrossVersion(self.helper, self.__btype)
+        # a cached result saves launching the pair
+        cache = self.helper.oracle_cache
+        key = cv.oracle_key(vers, html_file, muts)
+        if key:
+            is_bug = cache.get(key)
+            if is_bug is not None: return is_bug
+
         cv.start_browsers(vers)
-        is_bug = cv.cross_version_test_html(html_file, muts)
+        is_bug = cv.run_cross_version_test(html_file, muts)
         cv.stop_browsers()
+        if key: cache.put(key, is_bug)
         del cv
         return is_bug
 
@@ -207,18 +261,38 @@ class Bisecter(Thread):
         else:
             raise ValueError('Unsupported browser type')
 
-        self.ref_br = Browser(bt, ver)
+        if self.helper.pool:
+            self.ref_br = self.helper.pool.checkout(bt, ver)
+            return self.ref_br is not None
+
+        self.ref_br = Browser(bt, ver, server=self.helper.server)
         return self.ref_br.setup_browser()
 
     def stop_ref_browser(self) -> None:
         if self.ref_br:
-            self.ref_br.kill_browser()
+            self.helper.record_settle(self.ref_br.settle_stats)
+            self.ref_br.settle_stats.clear()
+            if self.helper.pool: self.helper.pool.checkin(self.ref_br)
+            else: self.ref_br.kill_browser()
             self.ref_br = None
 
     def get_browser(self, ver: int) -> None:
         pass
 
     def metamor_test(self, html_file: str, muts: list):
+        cache = self.helper.oracle_cache
+        key = None
+        if cache and not self.saveshot:
+            key = cache.key(self.helper.read_testcase(html_file), muts, [self.ref_br.version],
+                            (self.__btype, 'metamor', 4))
+            is_bug = cache.get(key)
+            if is_bug is not None: return is_bug
+
+        is_bug = self.run_metamor_test(html_file, muts)
+        if key: cache.put(key, is_bug)
+        return is_bug
+
+    def run_metamor_test(self, html_file: str, muts: list):
         thread_id = current_thread()
         br = self.ref_br
         for _ in range(4):
@@ -229,318 +303,161 @@ class Bisecter(Thread):
 
         return is_bug
 
-    def run(self) -> None:
-        cur_mid = None
+    def bisect(self, vers: Tuple[int, int], html_file: str, muts: list) -> None:
         hpr = self.helper
+        if len(muts) == 0:
+            raise ValueError('Something wrong in muts...')
 
-        while True:
-            popped = hpr.pop_from_queue()
-            if not popped: break
-
-            result, vers = popped
-            html_file, muts = result
-            if len(muts) == 0:
-                raise ValueError('Something wrong in muts...')
-
-            start, end = vers
-            if start >= end:
-                print (html_file, 'start and end are the same;')
-                continue
+        start, end = vers
+        if start >= end:
+            print (html_file, 'start and end are the same;')
+            return
 
-            start_idx = hpr.convert_to_index(start)
-            end_idx = hpr.convert_to_index(end)
+        start_idx = hpr.convert_to_index(start)
+        end_idx = hpr.convert_to_index(end)
 
-            if start_idx + 1 == end_idx:
-                if self.cross_version_test(vers, html_file, muts):
-                    hpr.update_postq(vers, html_file, muts)
-                continue
-
-            mid_idx = (start_idx + end_idx) // 2
-            mid = hpr.convert_to_ver(mid_idx)
+        if start_idx + 1 == end_idx:
+            if self.cross_version_test(vers, html_file, muts):
+                hpr.update_postq(vers, html_file, muts)
+            return
+
+        mid_idx = (start_idx + end_idx) // 2
+        mid = hpr.convert_to_ver(mid_idx)
+        if self.cur_mid != mid:
+            self.get_browser(mid)
+            if not self.start_ref_browser(mid):
+                self.cur_mid = None
+                return
             self.cur_mid = mid
-            if cur_mid != mid:
-                cur_mid = mid
-                self.get_browser(cur_mid)
-                if not self.start_ref_browser(cur_mid):
-                    continue
-
-            is_bug = self.metamor_test(html_file, muts)
-            if is_bug is None:
-                mid_prev = hpr.convert_to_ver(mid_idx - 1)
-                mid_next = hpr.convert_to_ver(mid_idx + 1)
-                vers1 = (start, mid_prev)
-                vers2 = (mid_next, end)
-                if self.cross_version_test(vers1, html_file, muts):
-                    hpr.insert_to_queue(vers1, html_file, muts)
-                if self.cross_version_test(vers2, html_file, muts):
-                    hpr.insert_to_queue(vers2, html_file, muts)
-                continue
-
-            elif not is_bug:
-                if mid_idx + 1 == end_idx:
-                    u_vers = (mid, end)
-                    if self.cross_version_test(u_vers, html_file, muts):
-                        hpr.update_postq(u_vers, html_file, muts)
-                        #print (html_file, mid, end, 'postq 1')
-                    continue
-                low = hpr.convert_to_ver(mid_idx)
-                high = end
-
-            else:
-                if mid_idx - 1 == start_idx:
-                    u_vers = (start, mid)
-                    if self.cross_version_test(u_vers, html_file, muts):
-                        hpr.update_postq(u_vers, html_file, muts)
-                        #print (html_file, start, mid, 'postq 2')
-                    continue
-                low = start
-                high = hpr.convert_to_ver(mid_idx)
-
-            hpr.insert_to_queue((low, high), html_file, muts)
-
-        self.stop_ref_browser()
-
-
-class Minimizer(CrossVersion):
-    def __init__(self, helper: IOQueue, browser_type: str) -> None:
-        CrossVersion.__init__(self, helper, browser_type)
-
-        self.__min_html = None
-        self.__html_file = None
-        self.__temp_file = None
-        self.__trim_file = None
 
-        self.__js_file = None
-
-
-    def __remove_temp_files(self):
-        os.remove(self.__temp_file)
-        os.remove(self.__trim_file)
-
-    def __initial_test(self, html_file: str):
-
-        self.__html_file = html_file
-        self.__trim_file = join(dirname(html_file),
-                'trim' + basename(html_file))
-        self.__temp_file = join(dirname(html_file),
-                'temp' + basename(html_file))
-
-        copyfile(html_file, self.__trim_file)
-        copyfile(html_file, self.__temp_file)
-
-        self.__js_file = html_file.replace('.html', '.js')
+        is_bug = self.metamor_test(html_file, muts)
+        if is_bug is None:
+            mid_prev = hpr.convert_to_ver(mid_idx - 1)
+            mid_next = hpr.convert_to_ver(mid_idx + 1)
+            vers1 = (start, mid_prev)
+            vers2 = (mid_next, end)
+            if self.cross_version_test(vers1, html_file, muts):
+                hpr.insert_to_queue(vers1, html_file, muts)
+            if self.cross_version_test(vers2, html_file, muts):
+                hpr.insert_to_queue(vers2, html_file, muts)
+            return
+
+        elif not is_bug:
+            if mid_idx + 1 == end_idx:
+                u_vers = (mid, end)
+                if self.cross_version_test(u_vers, html_file, muts):
+                    hpr.update_postq(u_vers, html_file, muts)
+                    #print (html_file, mid, end, 'postq 1')
+                return
+            low = hpr.convert_to_ver(mid_idx)
+            high = end
 
-        self.__min_html = FileManager.read_file(html_file)
-        self.__muts = FileManager.read_js_file(self.__js_file)
-        return self.cross_version_test_html(html_file, self.__muts)
+        else:
+            if mid_idx - 1 == start_idx:
+                u_vers = (start, mid)
+                if self.cross_version_test(u_vers, html_file, muts):
+                    hpr.update_postq(u_vers, html_file, muts)
+                    #print (html_file, start, mid, 'postq 2')
+                return
+            low = start
+            high = hpr.convert_to_ver(mid_idx)
 
-    def __minimize_sline(self, idx, style_lines):
-        style_line = style_lines[idx]
+        hpr.insert_to_queue((low, high), html_file, muts)
 
-        style_line = re.sub('{ ', '{ \n', style_line)
-        style_line = re.sub(' }', ' \n}', style_line)
-        style_line = re.sub('; ', '; \n', style_line)
-        style_blocks = style_line.split('\n')
+    def run_kary(self) -> None:
+        cur_vers = None
+        cur_rev = None
+        hpr = self.helper
 
-        min_blocks = style_blocks
-        min_indices = range(len(style_blocks))
+        while True:
+            task = hpr.pop_probe_task(prefer=cur_rev)
+            if task:
+                rev, probe, muts = task
+                html_file = probe[0]
+                is_bug = None
+                if self.cur_mid != rev:
+                    self.cur_mid = rev if self.start_ref_browser(rev) else None
+                if self.cur_mid == rev:
+                    is_bug = self.metamor_test(html_file, muts)
+                cur_rev = rev
+
+                done = hpr.report_probe(probe, rev, is_bug)
+                if not done: continue
+                vers, new_vers = done
+                # no probe was conclusive, fall back to a binary step
+                if vers == new_vers: self.bisect(vers, html_file, muts)
+                else: hpr.insert_to_queue(new_vers, html_file, muts)
+                continue
 
-        trim_sizes = [ pow(2,i) for i in range(3,-1,-1) ]
-        trim_sizes = [x for x in trim_sizes if x < len(style_blocks)]
-        for trim_size in trim_sizes:
-            for offset in range(1, len(style_blocks) - 2, trim_size):
-                if offset not in min_indices:
+            popped = hpr.pop_from_queue(prefer=cur_vers, split=True)
+            if not popped:
+                # probes of other threads may still narrow an interval
+                if hpr.probes_in_flight():
+                    time.sleep(1)
                     continue
-
-                trim_indices = range(offset, min(offset + trim_size, len(style_blocks) - 2))
-
-                tmp_blocks = []
-                tmp_indices = []
-                for i, line in enumerate(style_blocks):
-                    if i not in trim_indices and i in min_indices:
-                        tmp_blocks.append(style_blocks[i])
-                        tmp_indices.append(i)
-
-                last_block =  tmp_blocks[-1]
-                if last_block[-2:] == '; ':
-                    tmp_blocks[-1] = last_block[:-2] + ' '
-
-                tmp_line = ''.join(tmp_blocks) + '\n'
-
-                style_lines[idx] = tmp_line
-
-                tmp_html = re.sub(re.compile(r'<style>.*?</style>', re.DOTALL), \
-                                  '<style>' + ''.join(style_lines) + '</style>', self.__cat_html)
-
-                FileManager.write_file(self.__trim_file, tmp_html)
-
-                if self.cross_version_test_html(self.__trim_file, self.__muts):
-                    min_blocks = tmp_blocks
-                    min_indices = tmp_indices
-                    FileManager.write_file(self.__temp_file, tmp_html)
-
-        min_line = ''.join(min_blocks) + '\n'
-        return min_line
-
-    def __minimize_slines(self, style):
-        style_content = style.contents[0]
-        style_lines = [ line + '\n' for line in style_content.split('\n') if '{ }' not in line]
-
-        min_lines = style_lines
-        for i in range(len(style_lines)):
-            if 'DO NOT REMOVE' in style_lines[i]: 
+                if hpr.wait_for_input(): continue
                 break
-            min_line = self.__minimize_sline(i, min_lines)
-            min_lines[i] = min_line
-
-        min_style = '<style>\n' + ''.join(min_lines) + '</style>'
-        return min_style
-
-    def __minimize_style(self):
-        self.__cat_html = self.__min_html
-        soup = BeautifulSoup(self.__cat_html, "lxml")
-        if soup.style is not None and soup.style != " None":
-            try:
-                min_style = self.__minimize_slines(soup.style)
-                self.__cat_html = re.sub(re.compile(r'<style>.*?</style>', re.DOTALL), \
-                                       min_style, self.__cat_html)
-
-                self.__min_html = self.__cat_html
-            except:
-                return
-        else:
-            return True
 
-    def __minimize_dom(self):
-        br = self.get_newer_browser()
-        br.run_html(self.__temp_file)
-        attrs = br.get_dom_tree_info()
-        if not attrs: return
-
-        for i in reversed(range(len(attrs))):
-            br.run_html(self.__temp_file)
-            br.exec_script(f'document.body.querySelectorAll(\'*\')[{i}].remove();')
-
-            text = br.get_source()
-            if not text: continue
-            FileManager.write_file(self.__trim_file, text)
-            br.clean_html()
-            if self.cross_version_test_html(self.__trim_file, self.__muts):
-                self.__min_html = text
-                FileManager.write_file(self.__temp_file, self.__min_html)
-            else:
-                for attr in attrs[i]:
-                    br.run_html(self.__temp_file)
-                    br.exec_script(
-                            f'document.body.querySelectorAll(\'*\')[{i}].removeAttribute(\'{attr}\');')
-    
-                    text = br.get_source()
-                    if not text: continue
-                    FileManager.write_file(self.__trim_file, text)
-                    br.clean_html()
-                    if self.cross_version_test_html(self.__trim_file, self.__muts):
-                        self.__min_html = text
-                        FileManager.write_file(self.__temp_file, self.__min_html)
-
-    def __minimize_inner_element(self):
-        br = self.get_newer_browser()
-        br.run_html(self.__temp_file)
-        attrs = br.get_dom_tree_info()
-        if not attrs: return
-
-        for i in reversed(range(len(attrs))):
-            br.run_html(self.__temp_file)
-            br.exec_script(
-                f'temp1 = document.body.querySelectorAll(\'*\')[{i}];'.format(i) +
-                'if (temp1.nextElementSibling) {' +
-                'temp1.parentNode.append(...temp1.childNodes, temp1.nextElementSibling);}' +
-                'else { temp1.parentNode.append(...temp1.childNodes);} ' + 
-                'temp1.remove();'
-            )
-
-            text = br.get_source()
-            if not text: continue
-            FileManager.write_file(self.__trim_file, text)
-            br.clean_html()
-            if self.cross_version_test_html(self.__trim_file, self.__muts):
-                self.__min_html = text
-                FileManager.write_file(self.__temp_file, self.__min_html)
-
-    def __minimize_text(self):
-        br = self.get_newer_browser()
-        br.run_html(self.__temp_file)
-        attrs = br.get_dom_tree_info()
-        if not attrs: return
-
-        for i in reversed(range(len(attrs))):
-            br.run_html(self.__temp_file)
-            br.exec_script(f'document.body.querySelectorAll(\'*\')[{i}].textContent = \'\';')
-            text = br.get_source()
-            if not text: continue
-            FileManager.write_file(self.__trim_file, text)
-            br.clean_html()
-            if self.cross_version_test_html(self.__trim_file, self.__muts):
-                self.__min_html = text
-                FileManager.write_file(self.__temp_file, self.__min_html)
-
-    def __minimize_js(self):
-        muts = self.__muts.copy()
-        for i in reversed(range(len(muts))):
-            removed = muts.pop(i)
-            if self.cross_version_test_html(self.__temp_file, muts):
-                self.__muts.pop(i)
-            else:
-                muts.insert(i, removed)
-
-
-    def __minimizing(self):
-        self.__minimize_js()
-        self.__minimize_style()
-        self.__minimize_dom()
-        self.__minimize_text()
-        self.__minimize_inner_element()
+            result, vers = popped
+            html_file, muts = result
+            cur_vers = vers
+            if not hpr.split_probes(vers, html_file, muts):
+                self.bisect(vers, html_file, muts)
 
+        self.stop_ref_browser()
 
     def run(self) -> None:
+        if self.mode == 'kary':
+            self.run_kary()
+            return
+
         cur_vers = None
+        cur_probe = None
         hpr = self.helper
+
         while True:
-            popped = hpr.pop_from_queue()
-            if not popped: break
+            if self.mode == 'batch':
+                # every item of a group probes the same revision(s), so the
+                # reference browser is launched once for the whole group
+                group = hpr.pop_probe_group(prefer=cur_probe)
+                if not group and hpr.wait_for_input(): continue
+                if not group: break
+                cur_probe, items = group
+            else:
+                # items of the same interval probe the same mid revision
+                popped = hpr.pop_from_queue(prefer=cur_vers)
+                if not popped and hpr.wait_for_input(): continue
+                if not popped: break
+                items = [popped]
+
+            for result, vers in items:
+                html_file, muts = result
+                cur_vers = vers
+                self.bisect(vers, html_file, muts)
 
-            result, vers = popped
-            html_file, muts = result
+        self.stop_ref_browser()
 
-            if cur_vers != vers:
-                cur_vers = vers
-                if not self.start_browsers(cur_vers):
-                    continue
 
-            if self.__initial_test(html_file):
-                self.__minimizing()
-  
-                if self.cross_version_test_html(self.__temp_file, self.__muts):
-                    orig_html_file = os.path.splitext(html_file)[0] + '-orig.html'
-                    os.rename(html_file, orig_html_file) 
-                    copyfile(self.__temp_file, html_file)
-                    hpr.update_postq(vers, html_file, self.__muts)
+class Minimizer(CrossVersion, Reducer):
+    def __init__(self, helper: IOQueue, browser_type: str) -> None:
+        CrossVersion.__init__(self, helper, browser_type)
+        Reducer.__init__(self, self.name)
 
-            self.__remove_temp_files()
+    def oracle(self, html_file: str, muts: list, use_cache: bool = True) -> bool:
+        return self.cross_version_test_html(html_file, muts, use_cache)
 
+    def run(self) -> None:
+        self.minimize_queue()
         self.stop_browsers()
 
-class Metamong:
+class Metamong(Pipeline):
     def __init__(self, input_dir: str, output_dir: str, num_of_threads: int,
                  browser_type:str, base_version: int, target_version: int) -> None:
 
-        self.in_dir = input_dir
-        self.out_dir = output_dir
-        self.num_of_threads = num_of_threads
-        self.browser_type = browser_type
+        super().__init__(input_dir, output_dir, num_of_threads, browser_type)
         self.base_ver = base_version
         self.target_ver = target_version
 
-        self.experiment_result = {}
         self.tester = [
             SingleVersion,
             CrossVersion,
@@ -558,80 +475,39 @@ class Metamong:
     def skip_bisecter(self):
         self.tester.remove(Bisecter)
 
-    def test_wrapper(self, test_class: object, report: bool = False) -> None:
-        start = time.time()
-        threads = []
-        for i in range(self.num_of_threads):
-            threads.append(test_class(self.ioq, self.browser_type))
-            threads[-1].saveshot = report
-
-        class_name = type(threads[-1]).__name__
-        print (f'{class_name} stage starts...')
-
-        for th in threads:
-            th.start()
-
-        num_th = len(threads)
-        alive = num_th
-        while True:
-            self.ioq.monitoring()
-            time.sleep(1)
-
-            alive = 0
-            for th in threads:
-                if th.is_alive(): alive += 1
-
-            if alive == 0: break
-
-            if alive < num_th:
-                left = self.ioq.left()
-                print (f'{alive} of {num_th} Threads are alive, {left} inputs are left...')
-
-        self.ioq.reset_lock()
-        elapsed = time.time() - start
-        elapsed_time = str(timedelta(seconds=elapsed))
-        print (f'{class_name} stage ends...', elapsed_time)
-
-        if not report:
-            self.experiment_result[class_name] = [self.ioq.num_of_outputs, elapsed_time]
-        self.ioq.move_to_preqs()
-        if not report:
-            dirname = class_name
-            dir_path = os.path.join(self.out_dir, dirname)
-            self.ioq.dump_queue(dir_path)
-
+    def new_thread(self, test_class: object, id_: int, ioq):
+        return test_class(ioq, self.browser_type)
 
     def process(self) -> None:
         start = time.time()
+        self.remove_stale_files()
 
         self.vm = VersionManager(self.browser_type)
-        testcases = FileManager.get_all_files(self.in_dir, '.html')
+        corpus = load_corpora(self.in_dir, int(os.environ.get('CORPUS_WORKERS', '2')))
         rev_range = self.vm.get_rev_range(self.base_ver, self.target_ver)
 
+        # paged into the IOQueue, materialized corpus findings are files
+        testcases = FileManager.iter_files(self.in_dir, '.html')
+        testcases = chain(testcases, (t for t in corpus.paths() if not os.path.exists(t)))
+        self.ioq = IOQueue(testcases, rev_range, corpus=corpus)
 
-        num_of_tests = len(testcases)
+        num_of_tests = self.ioq.num_of_inputs
+        if self.ioq.is_paging(): num_of_tests = f'{num_of_tests}+'
         rev_a = rev_range[0]
         rev_b = rev_range[-1]
 
         print (f'# of tests: {num_of_tests}, rev_a: {rev_a}, rev_b: {rev_b}')
 
-        self.ioq = IOQueue(testcases, rev_range)
+        self.start_services(corpus, 3 * self.num_of_threads)
+        self.ioq.kary = self.num_of_threads + 1
 
         disp = Display(size=(1600, 1200))
         disp.start()
 
-        for test in self.tester: 
-            self.test_wrapper(test)
-
-        elapsed = time.time() - start
-        self.experiment_result['TOTAL TIME'] = str(timedelta(seconds=elapsed))
-
-        if self.report:
-            self.ioq.dump_queue_with_sort(os.path.join(self.out_dir, 'Report'))
-            for test in self.report: 
-                self.test_wrapper(test, True)
+        self.run(self.tester, os.environ.get('PIPELINE', 'stage') == 'stream', start)
 
         disp.stop()
+        self.stop_services()
         print (self.experiment_result)
 
 
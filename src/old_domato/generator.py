@@ -22,11 +22,20 @@ import os
 import re
 import random
 import sys
+import pickle
+import hashlib
+import tempfile
+import threading
 from shutil import copyfile
+# The grammar pickle cache and the compiled engine live in domato.grammar
+# only, old_domato/grammar.py is the unmodified original interpreter and is
+# not used by this generator.
 try:
-    from grammar import Grammar
-except:
-    from domato.grammar import Grammar
+    from domato.grammar import Grammar, private_cache_dir, open_cached
+except ImportError:
+    # run as a script from this directory
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from domato.grammar import Grammar, private_cache_dir, open_cached
 
 from multiprocessing import Process
 
@@ -312,7 +321,69 @@ def check_grammar(grammar):
             if tagname not in grammar._creators:
                 print('No creators for type ' + tagname)
 
+_grammars = None
+_grammars_lock = threading.Lock()
+
+
+def _grammar_hash(grammar_dir):
+    """Hashes the grammar files, the parser and the Python version."""
+    h = hashlib.sha1(sys.version.encode())
+    files = sorted(f for f in os.listdir(grammar_dir) if f.endswith('.txt'))
+    files.append(sys.modules[Grammar.__module__].__file__)
+    for filename in files:
+        with open(os.path.join(grammar_dir, filename), 'rb') as f:
+            h.update(filename.encode())
+            h.update(f.read())
+    return h.hexdigest()
+
+
 def setup_for_html_generation():
+    """Returns the shared (htmlgrammar, cssgrammar) pair of this process.
+
+    Generation does not modify a parsed grammar, so every MetaMut can share
+    one instance. Parsed and compiled grammars are cached in GRAMMAR_CACHE
+    (a private directory, ~/.cache/metamong by default) keyed by a hash of
+    the grammar files, set it to 'off' to always parse and interpret.
+    """
+    global _grammars
+    with _grammars_lock:
+        if _grammars is None:
+            _grammars = load_html_grammars()
+            cache_dir = os.environ.get('GRAMMAR_CACHE')
+            if _grammars and cache_dir != 'off':
+                _grammars[0].compile(cache_dir)
+        return _grammars
+
+
+def load_html_grammars():
+    grammar_dir = os.path.dirname(os.path.abspath(__file__))
+    cache_dir = os.environ.get('GRAMMAR_CACHE')
+    if cache_dir == 'off':
+        return parse_html_grammars()
+    # unpickling runs code, the cache must not be writable by others
+    cache_dir = private_cache_dir(cache_dir)
+    if cache_dir is None:
+        return parse_html_grammars()
+
+    cache_file = os.path.join(
+        cache_dir, 'metamong-grammar-%s.pickle' % _grammar_hash(grammar_dir))
+    try:
+        with open_cached(cache_file) as f:
+            return pickle.load(f)
+    except Exception:
+        pass
+
+    grammars = parse_html_grammars()
+    if grammars:
+        # Written to a temporary file first, processes may race on it.
+        fd, tmp_file = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(grammars, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    return grammars
+
+
+def parse_html_grammars():
     htmlgrammar = Grammar()
     grammar_dir = os.path.dirname(os.path.abspath(__file__))
     err = htmlgrammar.parse_from_file(os.path.join(grammar_dir, 'html.txt'))
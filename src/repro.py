@@ -3,6 +3,7 @@ import sys
 import bisect
 from pyvirtualdisplay import Display
 from utils.driver import Browser
+from utils.server import TestcaseServer
 from utils.helper import VersionManager
 from utils.helper import FileManager
 from utils.helper import ImageDiff
@@ -10,7 +11,20 @@ from utils.helper import ImageDiff
 import json
 import time
 
-def test(html_dir):
+def render(browser_type, version, popup, server, load, png):
+    # Every render gets a fresh browser, so nothing carries over between
+    # the actual and the expected page or between attempts.
+    b = Browser(browser_type, version, popup=popup, server=server)
+    if not b.setup_browser():
+        b.kill_browser()
+        return
+    load(b)
+    b.get_screenshot(png)
+    b.kill_browser()
+    phash, _ = ImageDiff.get_phash(png)
+    return phash
+
+def test(html_dir, server):
     if not os.path.isdir(html_dir): return
 
     con_file = os.path.join(html_dir, 'config.json')
@@ -36,43 +50,32 @@ def test(html_dir):
         else:
             version = json_object["target_ver"]
 
-    disp = Display(size=(1600, 1200))
-    disp.start()
     use_popup = True
     if "nopopup" in json_object:
         use_popup = False
 
     is_bug = False
     for _ in range(3):
-        b = Browser(browser_type, version, popup=use_popup)
-        b.setup_browser()
-
-        b.run_html_for_actual(poc_file, muts)
-
+        # both pages come from the TestcaseServer like in the fuzzer, the
+        # expected page is served from memory
         poc_png = poc_file.replace('.html', '.png')
-        b.get_screenshot(poc_png)
-        poc_hash, _ = ImageDiff.get_phash(poc_png)
-        b.kill_browser()
+        poc_hash = render(browser_type, version, use_popup, server,
+                          lambda b: b.run_html_for_actual(poc_file, muts), poc_png)
+        if poc_hash is None: break
 
-        b = Browser(browser_type, version, popup=use_popup)
-        b.setup_browser()
-        #b.run_html(exp_file)
-        b.run_html_for_expect(poc_file, muts, exp_file)
         exp_png = exp_file.replace('.html', '.png')
-        b.get_screenshot(exp_png)
-        exp_hash, _ = ImageDiff.get_phash(exp_png)
+        exp_hash = render(browser_type, version, use_popup, server,
+                          lambda b: b.run_html_for_expect(poc_file, muts), exp_png)
+        if exp_hash is None: break
 
         if ImageDiff.diff_images(poc_hash, exp_hash, phash=True):
             print ('Oracle detects the bug, poc:', poc_file)
             is_bug = True
             break
 
-        b.kill_browser()
-
     if not is_bug:
         print ('Oracle fails..., poc:', poc_file)
 
-    disp.stop()
     return is_bug
 
 
@@ -80,11 +83,17 @@ if __name__ == "__main__":
     url = sys.argv[1]
     num = 0
     bug = 0
+    disp = Display(size=(1600, 1200))
+    disp.start()
+    server = TestcaseServer([url])
+    server.start()
     for directory in sorted(os.listdir(url)):
         path = os.path.join(url, directory)
         if not os.path.isdir(path): continue
 
         num += 1
-        if test(path): 
+        if test(path, server): 
             bug += 1
+    server.stop()
+    disp.stop()
     print (f'bug: {bug}, number of testcases: {num}')
@@ -0,0 +1,6 @@
+import sys
+
+from os.path import dirname, abspath
+
+# the modules import each other relative to src/
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
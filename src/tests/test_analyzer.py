@@ -0,0 +1,37 @@
+from os.path import dirname, abspath, join
+
+from utils.analyzer import analyze_html
+
+SVG = '''<!DOCTYPE html>
+<html><head><style>
+#s { color: red; }
+</style></head><body>
+<div id="d" tabIndex="1"></div>
+<svg id="s" viewBox="0 0 10 10" preserveAspectRatio="none">
+<path id="p" pathLength="3"/>
+<foreignObject id="f"><div id="h" contentEditable="true"></div></foreignObject>
+</svg>
+</body></html>
+'''
+
+
+def test_svg_attributes_keep_camel_case():
+    attributes = analyze_html('', SVG)['attributes']
+    assert attributes['s'] == ['viewBox', 'preserveAspectRatio']
+    assert attributes['p'] == ['pathLength']
+
+
+def test_html_attributes_are_lowercased():
+    # like the DOM of an HTML document, also inside <foreignObject>
+    attributes = analyze_html('', SVG)['attributes']
+    assert attributes['d'] == ['tabindex']
+    assert attributes['h'] == ['contenteditable']
+
+
+def test_generator_manifest_matches_analyzer(monkeypatch):
+    monkeypatch.syspath_prepend(join(dirname(dirname(abspath(__file__))), 'domato'))
+    from generator import get_manifest
+
+    body = SVG.split('<body>')[1].split('</body>')[0]
+    manifest = get_manifest(body, '#s { color: red; }')
+    assert manifest['attributes'] == analyze_html('', SVG)['attributes']
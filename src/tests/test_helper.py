@@ -0,0 +1,34 @@
+from utils.helper import IOQueue
+
+
+def make_queue(monkeypatch, num: int, page_size: int = 2) -> IOQueue:
+    monkeypatch.setenv('PAGE_SIZE', str(page_size))
+    testcases = (f'/x/{i}.html' for i in range(num))
+    return IOQueue(testcases, [1, 2])
+
+
+def test_stage_queue_does_not_page_parent_source(monkeypatch):
+    q = make_queue(monkeypatch, 10)
+    assert q.is_paging()
+
+    staged = q.stage_queue()
+    assert not staged.is_paging()
+    assert staged.pop_from_queue() is None
+
+    # every input is left to the first stage
+    popped = []
+    while True:
+        value = q.pop_from_queue()
+        if not value: break
+        popped.append(value[0][0])
+    assert popped == [f'/x/{i}.html' for i in range(10)]
+
+
+def test_stage_queue_pops_forwarded_inputs(monkeypatch):
+    q = make_queue(monkeypatch, 10)
+    staged = q.stage_queue()
+    staged.insert_to_queue((1, 2), '/y/0.html', ['m'])
+
+    (html_file, muts), vers = staged.pop_from_queue()
+    assert (html_file, muts, vers) == ('/y/0.html', ['m'], (1, 2))
+    assert staged.pop_from_queue() is None
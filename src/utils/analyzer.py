@@ -0,0 +1,106 @@
+import re
+import json
+
+from os import walk
+from os.path import join, abspath
+from lxml import html as lhtml
+from lxml import etree
+
+from utils.helper import FileManager
+from domato.foreign import adjust_attribute
+
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+
+# Offline counterpart of Browser.analyze_html, it returns the same
+# {'ids', 'attributes', 'css_length'} dictionary without loading the
+# testcase in a browser.
+
+def get_elements(doc) -> list:
+    # document.body.querySelectorAll('*')
+    body = doc.find('body')
+    if body is None: return []
+    return [e for e in body.iterdescendants() if isinstance(e.tag, str)]
+
+def get_all_ids(elements: list) -> list:
+    ids = []
+    for e in elements:
+        name = e.get('id')
+        if name and name not in ids:
+            ids.append(name)
+    return ids
+
+def get_all_attributes(elements: list) -> dict:
+    # lxml lowercases every attribute name, the DOM keeps the camel case of
+    # some in SVG and MathML content
+    attributes = {}
+    for e in elements:
+        tags = [e.tag] + [p.tag for p in e.iterancestors()]
+        names = [adjust_attribute(name, tags) for name in e.attrib]
+        attributes[e.get('id', '')] = [name for name in names if name != 'id']
+    return attributes
+
+def count_css_rules(css: str) -> int:
+    # Top-level rules of a style sheet: blocks and ';' terminated at-rules.
+    # An upper bound of cssRules.length, the browser drops the rules it does
+    # not parse; DelCSS clamps the index to the rules it finds.
+    css = CSS_COMMENT.sub('', css)
+    num, depth, prelude, quote = 0, 0, '', ''
+    for c in css:
+        if quote:
+            if c == quote: quote = ''
+            if depth == 0: prelude += c
+        elif c in '"\'':
+            quote = c
+            if depth == 0: prelude += c
+        elif c == '{':
+            if depth == 0 and prelude.strip(): num += 1
+            depth += 1
+            prelude = ''
+        elif c == '}':
+            depth = max(0, depth - 1)
+            prelude = ''
+        elif c == ';' and depth == 0:
+            if prelude.strip().startswith('@'): num += 1
+            prelude = ''
+        elif depth == 0:
+            prelude += c
+    return num
+
+def get_css_length(doc) -> int:
+    # document.styleSheets[0] is the first <style> of the document
+    for style in doc.iter('style'):
+        return count_css_rules(style.text or '')
+    return 0
+
+def analyze_html(html_file: str, text: str = None) -> dict:
+    if text is None: text = FileManager.read_file(html_file)
+    try:
+        doc = lhtml.document_fromstring(text)
+    except (etree.ParserError, ValueError):
+        return {}
+
+    elements = get_elements(doc)
+    dic = {'ids': get_all_ids(elements),
+           'attributes': get_all_attributes(elements),
+           'css_length': get_css_length(doc),
+    }
+    for key in dic:
+        if not dic[key]: return {}
+    return dic
+
+def read_manifests(root: str) -> dict:
+    # Loads the manifest-*.jsonl files written by domato/generator.py,
+    # html file -> the analyze_html dictionary.
+    manifests = {}
+    for path, subdirs, files in walk(root):
+        for name in files:
+            if not name.startswith('manifest-') or not name.endswith('.jsonl'): continue
+            with open(join(path, name)) as fp:
+                for line in fp:
+                    try:
+                        dic = json.loads(line)
+                    except ValueError:
+                        continue
+                    html_file = abspath(join(path, dic.pop('file')))
+                    manifests[html_file] = dic
+    return manifests
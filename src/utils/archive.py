@@ -0,0 +1,181 @@
+import mmap
+import struct
+import argparse
+
+from os import walk, makedirs
+from os.path import join, abspath, dirname, exists, relpath, getsize
+
+# A packed corpus is an append-only data file of html + js records and an
+# index of (offset, html length, js length, name) entries next to it:
+#   corpus.pack, corpus.pack.idx
+# A record is only indexed once its data is written, so a torn write leaves
+# at most an unreferenced tail in the data file.
+
+INDEX_MAGIC = b'MMPK0001'
+ENTRY = struct.Struct('<QIIH')
+
+
+class ArchiveWriter:
+    def __init__(self, pack_file: str) -> None:
+        new_index = not exists(pack_file + '.idx')
+        self.__data = open(pack_file, 'ab')
+        self.__index = open(pack_file + '.idx', 'ab')
+        if new_index:
+            self.__index.write(INDEX_MAGIC)
+
+    def add(self, name: str, html: bytes, js: bytes = b'') -> None:
+        offset = self.__data.tell()
+        self.__data.write(html)
+        self.__data.write(js)
+        self.__data.flush()
+
+        name = name.encode()
+        self.__index.write(ENTRY.pack(offset, len(html), len(js), len(name)) + name)
+        self.__index.flush()
+
+    def close(self) -> None:
+        self.__data.close()
+        self.__index.close()
+
+
+class CorpusArchive:
+    # A testcase of the archive is named <dir of the archive>/<name>, the
+    # same path it had in the packed directory. Its file only exists once
+    # it is materialized (a finding).
+    def __init__(self, pack_file: str) -> None:
+        self.root = dirname(abspath(pack_file))
+        self.__entries = {}
+
+        with open(pack_file + '.idx', 'rb') as fp:
+            index = fp.read()
+        if not index.startswith(INDEX_MAGIC):
+            raise ValueError(f'{pack_file}.idx is not a corpus index')
+
+        pos = len(INDEX_MAGIC)
+        while pos + ENTRY.size <= len(index):
+            offset, html_len, js_len, name_len = ENTRY.unpack_from(index, pos)
+            pos += ENTRY.size
+            if pos + name_len > len(index): break
+            name = index[pos:pos + name_len].decode()
+            pos += name_len
+            self.__entries[join(self.root, name)] = (offset, html_len, js_len)
+
+        self.__fp = open(pack_file, 'rb')
+        self.__mm = None
+        if getsize(pack_file):
+            self.__mm = mmap.mmap(self.__fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__view = memoryview(self.__mm) if self.__mm else memoryview(b'')
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def paths(self) -> list:
+        return list(self.__entries.keys())
+
+    def has(self, html_file: str) -> bool:
+        return abspath(html_file) in self.__entries
+
+    def html_bytes(self, html_file: str) -> memoryview:
+        # zero-copy slice of the mapped data file
+        offset, html_len, _ = self.__entries[abspath(html_file)]
+        return self.__view[offset:offset + html_len]
+
+    def js_bytes(self, html_file: str) -> memoryview:
+        offset, html_len, js_len = self.__entries[abspath(html_file)]
+        start = offset + html_len
+        return self.__view[start:start + js_len]
+
+    def read(self, html_file: str) -> str:
+        if exists(html_file):
+            with open(html_file, 'r', newline='') as fp:
+                return fp.read()
+        return str(self.html_bytes(html_file), 'utf-8')
+
+    def read_bytes(self, html_file: str):
+        if exists(html_file):
+            with open(html_file, 'rb') as fp:
+                return fp.read()
+        return self.html_bytes(html_file)
+
+    def read_js(self, html_file: str) -> list:
+        # same lines as FileManager.read_js_file
+        js = str(self.js_bytes(html_file), 'utf-8')
+        if not js: return []
+        lines = js.split('\n')
+        if not lines[-1]: lines.pop()
+        return lines
+
+    def manifest(self, html_file: str):
+        return
+
+    def materialize(self, html_file: str) -> None:
+        if exists(html_file): return
+        makedirs(dirname(html_file), exist_ok=True)
+        with open(html_file, 'wb') as fp:
+            fp.write(self.html_bytes(html_file))
+
+    def close(self) -> None:
+        try:
+            self.__view.release()
+            if self.__mm: self.__mm.close()
+        except BufferError:
+            # a slice is still referenced, the mapping goes with the process
+            pass
+        self.__fp.close()
+
+
+def pack(src_dir: str, pack_file: str) -> int:
+    # Appends every .html (and its .js sidecar) of src_dir to the archive.
+    writer = ArchiveWriter(pack_file)
+    num = 0
+    for path, subdirs, files in walk(src_dir):
+        for name in sorted(files):
+            if not name.endswith('.html') or name.endswith('expected.html'): continue
+            html_file = join(path, name)
+            js_file = html_file[:-len('.html')] + '.js'
+            with open(html_file, 'rb') as fp:
+                html = fp.read()
+            js = b''
+            if exists(js_file):
+                with open(js_file, 'rb') as fp:
+                    js = fp.read()
+            writer.add(relpath(html_file, src_dir), html, js)
+            num += 1
+    writer.close()
+    return num
+
+
+def unpack(pack_file: str, dst_dir: str) -> int:
+    archive = CorpusArchive(pack_file)
+    for html_file in archive.paths():
+        name = relpath(html_file, archive.root)
+        new_html_file = join(dst_dir, name)
+        makedirs(dirname(new_html_file), exist_ok=True)
+        with open(new_html_file, 'wb') as fp:
+            fp.write(archive.html_bytes(html_file))
+        js = archive.js_bytes(html_file)
+        if len(js):
+            with open(new_html_file[:-len('.html')] + '.js', 'wb') as fp:
+                fp.write(js)
+    num = len(archive)
+    archive.close()
+    return num
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Packed corpus archives')
+    parser.add_argument('command', choices=['pack', 'unpack'])
+    parser.add_argument('archive', type=str, help='archive data file (e.g. corpus.pack)')
+    parser.add_argument('directory', type=str, help='testcase directory')
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        num = pack(args.directory, args.archive)
+        print (f'packed {num} testcases into {args.archive}')
+    else:
+        num = unpack(args.archive, args.directory)
+        print (f'unpacked {num} testcases into {args.directory}')
+
+
+if __name__ == '__main__':
+    main()
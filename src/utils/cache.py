@@ -0,0 +1,94 @@
+import json
+import sqlite3
+import hashlib
+
+from os import environ
+from os.path import join, dirname, abspath
+from threading import Lock
+from typing import Optional
+from collections import OrderedDict, defaultdict
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS oracle (
+    key TEXT PRIMARY KEY,
+    result INTEGER NOT NULL
+);
+"""
+
+# Results of the oracle (is the testcase a bug?) keyed by the testcase
+# content, its mutations, the revisions it was tested on and the settings
+# of the test, and by the harness and settle mode that make up the oracle
+# itself. A bounded LRU in memory, optionally backed by a SQLite file that
+# outlives the run. Inconclusive results (None) are not cached, they are
+# retried.
+class OracleCache:
+    def __init__(self, max_entries: int = 4096, path: Optional[str] = None) -> None:
+        self.__lock = Lock()
+        self.__entries = OrderedDict()
+        self.max_entries = max_entries
+
+        self.__conn = None
+        if path:
+            self.__conn = sqlite3.connect(path, check_same_thread=False)
+            self.__conn.execute('PRAGMA journal_mode=WAL')
+            self.__conn.execute('PRAGMA synchronous=NORMAL')
+            self.__conn.executescript(SCHEMA)
+            self.__conn.commit()
+
+        self.stats = defaultdict(int)
+
+        # entries of ORACLE_DB do not survive a change of the oracle
+        harness = join(dirname(dirname(abspath(__file__))), 'js', 'metamor.js')
+        with open(harness, 'rb') as fp:
+            self.oracle = [hashlib.sha1(fp.read()).hexdigest(),
+                           environ.get('SETTLE', 'paint'), environ.get('SETTLE_TIMEOUT', '0.5')]
+
+    def key(self, text: str, muts: list, revisions: list, settings: tuple) -> str:
+        h = hashlib.sha1(text.encode('utf-8', 'surrogateescape'))
+        h.update(json.dumps([muts, list(revisions), list(settings), self.oracle],
+                            sort_keys=True, default=str).encode())
+        return h.hexdigest()
+
+    def __remember(self, key: str, result: bool) -> None:
+        if not self.max_entries: return
+        self.__entries[key] = result
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.max_entries:
+            self.__entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[bool]:
+        with self.__lock:
+            result = self.__entries.get(key)
+            if result is not None:
+                self.__entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return result
+
+            if self.__conn:
+                row = self.__conn.execute('SELECT result FROM oracle WHERE key = ?', (key,)).fetchone()
+                if row:
+                    result = bool(row[0])
+                    self.__remember(key, result)
+                    self.stats['disk hits'] += 1
+                    return result
+
+            self.stats['misses'] += 1
+
+    def put(self, key: str, result: Optional[bool]) -> None:
+        if result is None: return
+        result = bool(result)
+        with self.__lock:
+            self.__remember(key, result)
+            if self.__conn:
+                self.__conn.execute('INSERT OR REPLACE INTO oracle (key, result) VALUES (?, ?)',
+                                    (key, int(result)))
+                self.__conn.commit()
+
+    def close(self) -> None:
+        with self.__lock:
+            if self.__conn:
+                self.__conn.close()
+                self.__conn = None
+
+    def summary(self) -> str:
+        return ', '.join(f'{key}: {self.stats[key]}' for key in ('hits', 'disk hits', 'misses'))
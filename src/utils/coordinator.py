@@ -0,0 +1,113 @@
+from os import environ
+from threading import Condition
+from typing import Callable, Optional, Tuple
+
+
+class Batch:
+    def __init__(self, vers: Tuple[int, int], candidates: list) -> None:
+        self.vers = vers
+        self.candidates = candidates
+        self.next = 0
+        self.running = 0
+        self.evaluated = 0
+        self.passed = None
+
+
+class ReductionCoordinator:
+    # Minimizer threads whose queue is drained help the ones still
+    # minimizing: the candidates of a ddmin round are fanned out to their
+    # browser pairs and the first candidate that reproduces wins.
+    def __init__(self) -> None:
+        self.__cond = Condition()
+        self.__batches = []
+        self.__owners = 0
+
+        # PARALLEL_MIN=0 keeps every candidate on the thread minimizing it
+        self.enabled = environ.get('PARALLEL_MIN', '1') != '0'
+        self.helpers = 0
+
+    def enter(self) -> None:
+        with self.__cond:
+            self.__owners += 1
+
+    def leave(self) -> None:
+        with self.__cond:
+            self.__owners -= 1
+            self.__cond.notify_all()
+
+    def __take(self, batch: Batch) -> Optional[int]:
+        if batch.passed is not None: return
+        if batch.next == len(batch.candidates): return
+        batch.next += 1
+        batch.running += 1
+        return batch.next - 1
+
+    def __done(self, batch: Batch, i: int, passed: bool) -> None:
+        with self.__cond:
+            batch.running -= 1
+            batch.evaluated += 1
+            if passed and batch.passed is None:
+                batch.passed = i
+            self.__cond.notify_all()
+
+    def __evaluate(self, evaluate: Callable, batch: Batch, i: int) -> None:
+        # a candidate whose test raises (e.g. a crashed browser) fails,
+        # the exception must not end a helping thread
+        passed = False
+        try:
+            passed = evaluate(batch.vers, batch.candidates[i])
+        except Exception as e:
+            print (e)
+        finally:
+            self.__done(batch, i, passed)
+
+    def first_passing(self, vers: Tuple[int, int], candidates: list,
+                      evaluate: Callable) -> Tuple[Optional[int], int]:
+        # Returns the index of the first candidate that reproduces and the
+        # number of candidates evaluated until then, the owner evaluates
+        # candidates as well. Candidates still running on a helper are
+        # left to finish, their result is dropped.
+        batch = Batch(vers, candidates)
+        with self.__cond:
+            self.__batches.append(batch)
+            self.__cond.notify_all()
+
+        try:
+            while True:
+                with self.__cond:
+                    i = self.__take(batch)
+                    while i is None and batch.passed is None and batch.running:
+                        self.__cond.wait()
+                        i = self.__take(batch)
+                    if i is None: break
+                self.__evaluate(evaluate, batch, i)
+        finally:
+            with self.__cond:
+                self.__batches.remove(batch)
+
+        return batch.passed, batch.evaluated
+
+    def __next_job(self) -> Optional[Tuple[Batch, int]]:
+        with self.__cond:
+            while True:
+                for batch in self.__batches:
+                    i = self.__take(batch)
+                    if i is not None: return batch, i
+                if not self.__owners: return
+                self.__cond.wait(1)
+
+    def serve(self, evaluate: Callable) -> None:
+        # Called by a thread whose queue is drained, returns once no thread
+        # is minimizing.
+        if not self.enabled: return
+        with self.__cond:
+            self.helpers += 1
+
+        try:
+            while True:
+                job = self.__next_job()
+                if job is None: break
+                self.__evaluate(evaluate, *job)
+        finally:
+            with self.__cond:
+                self.helpers -= 1
@@ -0,0 +1,171 @@
+import sys
+
+from threading import Lock
+from collections import OrderedDict
+from multiprocessing import Pool
+from os import walk
+from os.path import join, abspath, exists
+
+from utils.helper import FileManager, printf
+from utils.source import DOMATO_DIR
+from utils.archive import CorpusArchive
+
+# Set up by init_worker in each regeneration process. The grammars use the
+# global random module, so samples are regenerated in separate processes
+# and never disturb the seeded random state of the fuzzer threads.
+_worker = None
+
+def init_worker() -> None:
+    global _worker
+    sys.path.insert(0, DOMATO_DIR)
+    import generator
+    template = FileManager.read_file(join(DOMATO_DIR, 'template.html'))
+    _worker = (generator, template, generator.setup_grammars())
+
+def get_grammar_hash() -> str:
+    return _worker[0].grammar_hash()
+
+def regenerate(seed: int) -> tuple:
+    generator, template, (htmlgrammar, cssgrammar) = _worker
+    manifest = {}
+    html = generator.generate_seeded_sample(template, htmlgrammar, cssgrammar, seed, manifest)
+    return html, manifest
+
+
+class SeedCorpus:
+    # Testcases recorded as seeds by domato/generator.py --seeds. A testcase
+    # is named <dir of its corpus file>/seed-<seed>.html and is regenerated
+    # in memory, the file only exists once it is materialized (a finding).
+    def __init__(self, root: str, num_of_workers: int = 1, cache_size: int = 256) -> None:
+        self.__seeds = {}
+        self.__pool = None
+
+        self.__lock = Lock()
+        self.__cache = OrderedDict()
+        self.cache_size = cache_size
+
+        corpus_files = []
+        for path, subdirs, files in walk(root):
+            for name in files:
+                if name.endswith('.seeds'): corpus_files.append(join(path, name))
+        if not corpus_files: return
+
+        self.__pool = Pool(num_of_workers, initializer=init_worker)
+        cur_hash = self.__pool.apply(get_grammar_hash)
+        for corpus_file in sorted(corpus_files):
+            self.__load(corpus_file, cur_hash)
+
+    def __load(self, corpus_file: str, cur_hash: str) -> None:
+        with open(corpus_file) as fp:
+            header = fp.readline().split()
+            if len(header) != 2 or header[1] != cur_hash:
+                printf('WARNING', f'{corpus_file} was recorded with another grammar, skipped')
+                return
+            dir_path = abspath(join(corpus_file, '..'))
+            for line in fp:
+                line = line.strip()
+                if not line: continue
+                seed = int(line)
+                self.__seeds[join(dir_path, f'seed-{seed}.html')] = seed
+
+    def __len__(self) -> int:
+        return len(self.__seeds)
+
+    def paths(self) -> list:
+        return list(self.__seeds.keys())
+
+    def has(self, html_file: str) -> bool:
+        return abspath(html_file) in self.__seeds
+
+    def __get(self, html_file: str) -> tuple:
+        html_file = abspath(html_file)
+        with self.__lock:
+            if html_file in self.__cache:
+                self.__cache.move_to_end(html_file)
+                return self.__cache[html_file]
+
+        value = self.__pool.apply(regenerate, (self.__seeds[html_file],))
+        with self.__lock:
+            self.__cache[html_file] = value
+            if len(self.__cache) > self.cache_size:
+                self.__cache.popitem(last=False)
+        return value
+
+    def read(self, html_file: str) -> str:
+        if exists(html_file):
+            with open(html_file, 'r', newline='') as fp:
+                return fp.read()
+        return self.__get(html_file)[0]
+
+    def read_bytes(self, html_file: str) -> bytes:
+        return self.read(html_file).encode()
+
+    def read_js(self, html_file: str) -> list:
+        return []
+
+    def manifest(self, html_file: str) -> dict:
+        return self.__get(html_file)[1]
+
+    def materialize(self, html_file: str) -> None:
+        if exists(html_file): return
+        FileManager.write_file(html_file, self.__get(html_file)[0])
+
+    def close(self) -> None:
+        if self.__pool:
+            self.__pool.terminate()
+            self.__pool = None
+
+
+class CorpusSet:
+    # Testcases of several corpora, seed corpora and packed archives, each
+    # call goes to the corpus holding the path.
+    def __init__(self, corpora: list) -> None:
+        self.corpora = corpora
+
+    def __len__(self) -> int:
+        return sum(len(corpus) for corpus in self.corpora)
+
+    def __find(self, html_file: str):
+        for corpus in self.corpora:
+            if corpus.has(html_file): return corpus
+
+    def paths(self) -> list:
+        paths = []
+        for corpus in self.corpora:
+            paths.extend(corpus.paths())
+        return paths
+
+    def has(self, html_file: str) -> bool:
+        return self.__find(html_file) is not None
+
+    def read(self, html_file: str) -> str:
+        return self.__find(html_file).read(html_file)
+
+    def read_bytes(self, html_file: str):
+        return self.__find(html_file).read_bytes(html_file)
+
+    def read_js(self, html_file: str) -> list:
+        return self.__find(html_file).read_js(html_file)
+
+    def manifest(self, html_file: str):
+        return self.__find(html_file).manifest(html_file)
+
+    def materialize(self, html_file: str) -> None:
+        self.__find(html_file).materialize(html_file)
+
+    def close(self) -> None:
+        for corpus in self.corpora:
+            corpus.close()
+
+
+def load_corpora(root: str, num_of_workers: int = 1) -> CorpusSet:
+    # *.seeds files and *.pack archives under root
+    corpora = [SeedCorpus(root, num_of_workers)]
+    for path, subdirs, files in walk(root):
+        for name in sorted(files):
+            if not name.endswith('.pack'): continue
+            try:
+                corpora.append(CorpusArchive(join(path, name)))
+            except (OSError, ValueError) as e:
+                printf('WARNING', f'{join(path, name)} is skipped, {e}')
+    return CorpusSet(corpora)
@@ -0,0 +1,175 @@
+import re
+
+from typing import Optional
+
+# A small CSS tokenizer and parser for the Minimizer, close to what
+# document.styleSheets exposes: a style sheet is a list of rules, a style
+# rule has selectors and declarations, a grouping at-rule (@media, ...)
+# has rules and any other at-rule keeps its prelude and, if it has a block,
+# the block split into declarations (@font-face descriptors). Comments are
+# dropped, anything else survives a parse and serialize round trip.
+
+TOKEN = re.compile(r'''
+    (?P<comment>/\*.*?(?:\*/|\Z))
+  | (?P<string>"(?:[^"\\\n]|\\.)*"?|'(?:[^'\\\n]|\\.)*'?)
+  | (?P<url>url\(\s*[^'"()\s]*\s*\))
+  | (?P<delim>[{}()\[\];,])
+  | (?P<ws>\s+)
+  | (?P<other>\\.|/|[^{}()\[\];,"'/\\\s]+)
+''', re.S | re.X | re.I)
+
+GROUP_RULES = ('@media', '@supports', '@document', '@-moz-document', '@layer', '@container')
+
+OPEN = {'(': ')', '[': ']', '{': '}'}
+
+def tokenize(css: str) -> list:
+    # (kind, text) tokens without comments
+    tokens = []
+    for m in TOKEN.finditer(css):
+        if m.lastgroup != 'comment':
+            tokens.append((m.lastgroup, m.group()))
+    return tokens
+
+def join(tokens: list) -> str:
+    # whitespace outside strings is collapsed
+    return ''.join(' ' if kind == 'ws' else text for kind, text in tokens).strip()
+
+def split(tokens: list, sep: str) -> list:
+    # texts of the tokens between top-level separators
+    parts, part, depth = [], [], 0
+    for kind, text in tokens:
+        if kind == 'delim' and text in OPEN: depth += 1
+        elif kind == 'delim' and text in ')]}': depth = max(0, depth - 1)
+        elif kind == 'delim' and text == sep and depth == 0:
+            parts.append(part)
+            part = []
+            continue
+        part.append((kind, text))
+    parts.append(part)
+    texts = [join(part) for part in parts]
+    return [text for text in texts if text]
+
+
+class Rule:
+    def __init__(self, prelude: str, selectors: list = None,
+                 declarations: list = None, rules: list = None) -> None:
+        self.prelude = prelude
+        self.selectors = selectors
+        self.declarations = declarations
+        self.rules = rules
+
+    def copy(self):
+        return Rule(self.prelude,
+                    None if self.selectors is None else list(self.selectors),
+                    None if self.declarations is None else list(self.declarations),
+                    None if self.rules is None else [rule.copy() for rule in self.rules])
+
+    def serialize(self) -> str:
+        if self.rules is not None:
+            return self.prelude + ' {\n' + serialize_stylesheet(self.rules) + '}'
+        if self.declarations is None:
+            return self.prelude + ';'
+        prelude = ', '.join(self.selectors) if self.selectors is not None else self.prelude
+        if not self.declarations: return prelude + ' { }'
+        return prelude + ' { ' + '; '.join(self.declarations) + ' }'
+
+
+def parse_rules(tokens: list, i: int, nested: bool) -> tuple:
+    # Returns the rules and the position after the block they are in.
+    rules = []
+    prelude = []
+    while i < len(tokens):
+        kind, text = tokens[i]
+        i += 1
+        if kind != 'delim' or text not in '{};':
+            prelude.append((kind, text))
+            if kind == 'delim' and text in '([':
+                # a ';' or '{' inside parentheses is not the end of a prelude
+                depth = 1
+                while i < len(tokens) and depth:
+                    kind, text = tokens[i]
+                    i += 1
+                    if kind == 'delim' and text in '([': depth += 1
+                    elif kind == 'delim' and text in ')]': depth -= 1
+                    prelude.append((kind, text))
+            continue
+
+        if text == '}':
+            if nested: return rules, i
+            prelude = []
+            continue
+
+        name = join(prelude)
+        prelude_tokens = prelude
+        prelude = []
+        if text == ';':
+            if name: rules.append(Rule(name))
+            continue
+
+        if name.lower().startswith(GROUP_RULES):
+            children, i = parse_rules(tokens, i, True)
+            rules.append(Rule(name, rules=children))
+            continue
+
+        body, depth = [], 1
+        while i < len(tokens):
+            kind, text = tokens[i]
+            i += 1
+            if kind == 'delim' and text in OPEN: depth += 1
+            elif kind == 'delim' and text in ')]}': depth -= 1
+            if depth == 0: break
+            body.append((kind, text))
+
+        declarations = split(body, ';')
+        if name.startswith('@'):
+            rules.append(Rule(name, declarations=declarations))
+        else:
+            rules.append(Rule(name, split(prelude_tokens, ','), declarations))
+
+    return rules, i
+
+def parse_stylesheet(css: str) -> list:
+    rules, _ = parse_rules(tokenize(css), 0, False)
+    return rules
+
+def serialize_stylesheet(rules: list) -> str:
+    return ''.join(rule.serialize() + '\n' for rule in rules)
+
+def rule_paths(rules: list, parent: tuple = ()) -> list:
+    # index paths of every rule, a grouping rule before its rules
+    paths = []
+    for i, rule in enumerate(rules):
+        paths.append(parent + (i,))
+        if rule.rules is not None:
+            paths.extend(rule_paths(rule.rules, parent + (i,)))
+    return paths
+
+def get_rule(rules: list, path: tuple) -> Rule:
+    rule = rules[path[0]]
+    for i in path[1:]:
+        rule = rule.rules[i]
+    return rule
+
+def remove_rules(rules: list, paths: list) -> list:
+    rules = [rule.copy() for rule in rules]
+    # the last first, so the other paths stay valid
+    for path in sorted(paths, reverse=True):
+        siblings = rules if len(path) == 1 else get_rule(rules, path[:-1]).rules
+        siblings.pop(path[-1])
+    return rules
+
+def remove_selectors(rules: list, items: list) -> Optional[list]:
+    # items: (rule path, selector index) pairs, a rule keeps a selector
+    rules = [rule.copy() for rule in rules]
+    for path, j in sorted(items, reverse=True):
+        get_rule(rules, path).selectors.pop(j)
+    for path in set(path for path, _ in items):
+        if not get_rule(rules, path).selectors: return
+    return rules
+
+def remove_declarations(rules: list, items: list) -> list:
+    # items: (rule path, declaration index) pairs
+    rules = [rule.copy() for rule in rules]
+    for path, j in sorted(items, reverse=True):
+        get_rule(rules, path).declarations.pop(j)
+    return rules
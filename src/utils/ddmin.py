@@ -0,0 +1,55 @@
+from typing import Callable, Optional
+
+# Delta debugging (Zeller and Hildebrandt, ddmin). test(items) is True if
+# the testcase built from items still reproduces; it is never called with
+# the full list, which is known to reproduce. The result is 1-minimal:
+# removing any single item of it no longer reproduces.
+#
+# first(configs) returns the index of a config that reproduces or None, the
+# candidates of a round are independent, so it may test them in parallel.
+
+def split(items: list, n: int) -> list:
+    chunks = []
+    start = 0
+    for i in range(n):
+        end = start + (len(items) - start) // (n - i)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+def first_in_order(test: Callable[[list], bool]) -> Callable[[list], Optional[int]]:
+    def first(configs: list) -> Optional[int]:
+        for i, config in enumerate(configs):
+            if test(config): return i
+    return first
+
+def ddmin(items: list, test: Callable[[list], bool],
+          first: Optional[Callable[[list], Optional[int]]] = None) -> list:
+    if not items: return items
+    if first is None: first = first_in_order(test)
+
+    # whole subtrees or rule lists are often irrelevant
+    if test([]): return []
+
+    n = 2
+    while len(items) >= 2:
+        chunks = split(items, n)
+
+        reduced = False
+        if len(chunks) > 2:
+            i = first(chunks)
+            if i is not None:
+                items, n, reduced = chunks[i], 2, True
+
+        if not reduced:
+            complements = [[x for chunk in chunks[:i] + chunks[i + 1:] for x in chunk]
+                           for i in range(len(chunks))]
+            i = first(complements)
+            if i is not None:
+                items, n, reduced = complements[i], max(n - 1, 2), True
+
+        if reduced: continue
+        if n >= len(items): break
+        n = min(len(items), n * 2)
+
+    return items
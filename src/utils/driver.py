@@ -1,5 +1,6 @@
 import sys
 import time, psutil
+from uuid import uuid4
 from pathlib import Path
 
 from selenium import webdriver
@@ -14,19 +15,73 @@ from utils.chrome_binary import ChromeBinary
 from utils.firefox_binary import FirefoxBinary
 
 
-GET_ATTRNAMES="""
-let attrs = [];
-const elements = document.body.querySelectorAll('*');
-for (var i = 0; i < elements.length; i++) {
-  attrs.push(elements[i].getAttributeNames());
-}
-return attrs;
+GET_PAGE="""return window.SC.get_page();"""
+
+# Replaces the current testcase document with arguments[0] in memory; the
+# base URL is kept, so the harness script still resolves. Only used when
+# there is no TestcaseServer to navigate to.
+WRITE_DOCUMENT="""
+window.scrollTo(0, 0);
+document.open();
+document.write(arguments[0]);
+document.close();
+return true;
 """
 
-GET_PAGE="""return window.SC.get_page();"""
+# Resolves once the page has produced two animation frames after a forced
+# layout, i.e. the mutation has been painted, or with -1 after the bound.
+# In sleep mode it simply resolves with null after the bound.
+SETTLE="""
+const settle = (mode, bound) => new Promise((resolve) => {
+  if (mode === 'sleep') {
+    setTimeout(() => resolve(null), bound);
+    return;
+  }
+  const start = performance.now();
+  const timer = setTimeout(() => resolve(-1), bound);
+  if (document.body) document.body.getBoundingClientRect();
+  requestAnimationFrame(() => requestAnimationFrame(() => {
+    clearTimeout(timer);
+    resolve(performance.now() - start);
+  }));
+});
+"""
+
+WAIT_FOR_PAINT = SETTLE + """
+settle('paint', arguments[0]).then(arguments[arguments.length - 1]);
+"""
+
+# Each entry is run as the body of a function, like execute_script does.
+STATE_SCRIPTS = {
+    #'dom': 'return get_dom_tree();',
+    #'css': 'return get_css_rules();',
+    'focus': 'return get_focus_node();',
+    'scroll': 'return get_scroll_position();',
+    'animation': 'return get_animations();',
+}
+
+# Applies every mutation (settling after each one) and collects the state
+# in a single round-trip. A failing script yields null, as exec_script does.
+RUN_MUTATIONS = SETTLE + """
+const [muts, scripts, mode, bound] = arguments;
+const done = arguments[arguments.length - 1];
+const run = (body) => {
+  try { return (new Function(body))(); } catch (e) { return null; }
+};
+(async () => {
+  const settles = [];
+  for (const mut of muts) {
+    run(mut);
+    settles.push(await settle(mode, bound));
+  }
+  const state = {};
+  for (const key in scripts) state[key] = run(scripts[key]);
+  done({'state': state, 'settles': settles});
+})();
+"""
 
 class Browser:
-    def __init__(self, browser_type: str, commit_version: int, flags: str = '', popup: bool = False, vid_: str = '') -> None:
+    def __init__(self, browser_type: str, commit_version: int, flags: str = '', popup: bool = False, vid_: str = '', server = None) -> None:
         environ["DBUS_SESSION_BUS_ADDRESS"] = '/dev/null'
 
         self.__width = 800
@@ -50,6 +105,16 @@ class Browser:
         self.__popup = popup
         self.__vid = vid_
 
+        # Optional TestcaseServer; testcases are loaded from file:// without it.
+        self.server = server
+        self.__page_key = uuid4().hex
+
+        # SETTLE=sleep restores the fixed sleep after every mutation,
+        # SETTLE_TIMEOUT is the upper bound (in seconds) of a single settle.
+        self.settle_mode = environ.get('SETTLE', 'paint')
+        self.settle_timeout = float(environ.get('SETTLE_TIMEOUT', '0.5'))
+        self.settle_stats = defaultdict(float)
+
     def __set_viewport_size(self):
         window_size = self.browser.execute_script("""
         return [window.outerWidth - window.innerWidth + arguments[0],
@@ -169,6 +234,7 @@ class Browser:
         return setup_complete
 
     def kill_browser(self):
+        if self.server: self.server.drop_page(self.__page_key)
         if self.browser and self.browser.session_id:
             try:
                 self.browser.close()
@@ -178,6 +244,9 @@ class Browser:
 
         return True
 
+    def is_alive(self):
+        return self.exec_script('return 1;') == 1
+
     def kill_browser_by_pid(self):
         if not self.browser: return False
         br = self.browser
@@ -191,23 +260,57 @@ class Browser:
             pass
         return True
 
-    def get_source(self):
-        try: return '<!DOCTYPE html>\n' + self.browser.page_source
-        except: return
-
     def exec_script(self, scr, arg=None):
         try:
             return self.browser.execute_script(scr, arg)
         except Exception as e:
             return None
 
+    def exec_async_script(self, scr, *args):
+        try:
+            return self.browser.execute_async_script(scr, *args)
+        except Exception as e:
+            return None
+
+    def record_settle(self, elapsed: float, timeout: bool = False):
+        stats = self.settle_stats
+        stats['count'] += 1
+        stats['total'] += elapsed
+        stats['max'] = max(stats['max'], elapsed)
+        if timeout: stats['timeout'] += 1
+
+    def wait_for_settle(self):
+        if self.settle_mode == 'sleep':
+            time.sleep(self.settle_timeout)
+            return
+
+        start = time.time()
+        elapsed = self.exec_async_script(WAIT_FOR_PAINT, int(self.settle_timeout * 1000))
+        if elapsed is None or elapsed < 0:
+            self.record_settle((time.time() - start) * 1000, timeout=True)
+        else:
+            self.record_settle(elapsed)
+
+    def run_muts_and_get_state(self, muts: list, scripts: dict = STATE_SCRIPTS):
+        bound = int(self.settle_timeout * 1000)
+        result = self.exec_async_script(RUN_MUTATIONS, muts, scripts,
+                                        self.settle_mode, bound)
+        if not result: return
+
+        for elapsed in result['settles']:
+            if elapsed is None: continue
+            elif elapsed < 0: self.record_settle(bound, timeout=True)
+            else: self.record_settle(elapsed)
+        return result['state']
+
     def run_html(self, html_file: str):
         if self.__num_of_run == 1000:
             self.kill_browser()
             self.setup_browser()
         try:
             if self.__popup: self.__set_viewport_size()
-            self.browser.get('file://' + abspath(html_file))
+            if self.server: self.browser.get(self.server.url_for(html_file))
+            else: self.browser.get('file://' + abspath(html_file))
             self.__num_of_run += 1
             return True
         except Exception as e:
@@ -223,28 +326,30 @@ class Browser:
         if not self.run_html(html_file): return False
         for mut in muts:
             self.exec_script(mut)
-            time.sleep(0.5)
+            self.wait_for_settle()
         self.__num_of_run += 1
         #self.exec_script(f'document.close();')
         return True
 
-    def run_html_for_expect(self, html_file: str, muts: list, name=''):
+    def run_html_for_expect(self, html_file: str, muts: list):
         if self.__num_of_run == 1000:
             self.kill_browser()
             self.setup_browser()
+            # A fresh browser has no testcase document to rewrite yet.
+            if not self.server and not self.run_html(html_file): return False
 
         if self.__popup: 
             try: self.__set_viewport_size()
             except Exception as e: return False
-        text = FileManager.read_file(html_file)
+        if self.server: text = self.server.read_testcase(html_file)
+        else: text = FileManager.read_file(html_file)
+        if text is None: return False
         js = '\n;'.join(muts)
         text += '\n' + f'<script>{js}</script>'
-        if name:
-            FileManager.write_file(name, text)
-            self.run_html(name)
-        else:
-            self.exec_script(f'document.write(`{text}`);')
-            self.exec_script(f'document.close();')
+        if self.server:
+            try: self.browser.get(self.server.put_page(self.__page_key, text))
+            except Exception as e: return False
+        elif self.exec_script(WRITE_DOCUMENT, text) is None: return False
         self.__num_of_run += 1
         return True
 
@@ -262,9 +367,6 @@ class Browser:
 
         return None
 
-    def get_dom_tree_info(self):
-        return self.exec_script(GET_ATTRNAMES)
-
     def analyze_html(self, html_file):
         dic = {}
         if not self.run_html(html_file): return 
@@ -288,19 +390,6 @@ class Browser:
     def __is_same_state(self):
         return self.exec_script("return window.SC.is_same_state();")
 
-    def __get_all_state(self):
-        state = {}
-        try:
-            #state["dom"] = self.exec_script("return get_dom_tree();")
-            #state["css"] = self.exec_script("return get_css_rules();")
-            state["focus"] = self.exec_script("return get_focus_node();")
-            state["scroll"] = self.exec_script("return get_scroll_position();")
-            state["animation"] = self.exec_script("return get_animations();")
-            return state
-        except Exception as e:
-            print (e)
-            return {}
-
     def __state_compare(self, s1, s2):
         for key in s1:
             if s1[key] != s2[key]:
@@ -312,25 +401,28 @@ class Browser:
             self.kill_browser_by_pid()
             self.setup_browser()
 
-        if not self.run_html_for_actual(html_file, muts): return
+        if not self.run_html(html_file): return
+        self.__num_of_run += 1
+
+        # the mutations share one round-trip, the state is collected after
+        # the screenshot like on the expected page
+        if self.run_muts_and_get_state(muts, {}) is None: return
 
         name_noext = splitext(html_file)[0]
         screenshot_name = f'{name_noext}_{self.version}_a.png' if save_shot else None
         hash_v1 = self.__screenshot_and_hash(screenshot_name, phash=phash)
         if not hash_v1: return
 
-        # save state
-        actual_state = self.__get_all_state()
+        actual_state = self.run_muts_and_get_state([])
         if not actual_state: return
 
-        exp_file = html_file.replace('.html', '_expected.html')
-        if not self.run_html_for_expect(html_file, muts, exp_file): return 
+        if not self.run_html_for_expect(html_file, muts): return 
 
         screenshot_name = f'{name_noext}_{self.version}_b.png' if save_shot else None
         hash_v2 = self.__screenshot_and_hash(screenshot_name, phash=phash)
         if not hash_v2: return
 
-        expected_state = self.__get_all_state()
+        expected_state = self.run_muts_and_get_state([])
         if not expected_state: return
 
         if not self.__state_compare(actual_state, expected_state): return
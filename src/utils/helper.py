@@ -8,29 +8,35 @@ from pathlib import Path
 from random import choice
 from threading import Lock
 from threading import Semaphore
+from threading import current_thread
+from threading import Event
 from typing import Optional, Tuple
 from shutil import copyfile
+from itertools import islice
 from collections import defaultdict
 
 from contextlib import contextmanager
 
 from PIL import Image
 from io import BytesIO
-from os import walk, listdir, getenv
+from os import walk, listdir, getenv, remove
 from os.path import join, dirname, abspath, exists, basename
 
 from utils.firefox_binary import build_firefox_binary
 from utils.chrome_binary import ChromeBinary
 from utils.chrome_binary import build_chrome_binary
 from utils.chrome_binary import get_commit_from_position
+from utils.coordinator import ReductionCoordinator
 
 
 @contextmanager
 def acquire_timeout(lock, timeout):
     result = lock.acquire(timeout=timeout)
-    yield result
-    if result:
-        lock.release()
+    try:
+        yield result
+    finally:
+        if result:
+            lock.release()
 
 CHROME_MILESTONE = {
     79: 706915,
@@ -101,7 +107,7 @@ def printf(color, p):
 
 
 class IOQueue:
-    def __init__(self, testcases: list, revision_range: list) -> None:
+    def __init__(self, testcases, revision_range: list, store = None, corpus = None) -> None:
 
         self.__queue_lock = Lock()
         self.__build_lock = Semaphore(1)
@@ -121,20 +127,111 @@ class IOQueue:
         limit = getenv('LIMIT')
         self.limit = 100000 if not limit else int(limit)
 
+        # SCHEDULER=random makes every thread drain the same randomly
+        # selected version; sticky lets a thread keep its running version.
+        self.sticky = getenv('SCHEDULER', 'sticky') == 'sticky'
+        self.sched_stats = defaultdict(int)
+
+        batch_size = getenv('BATCH_SIZE')
+        self.batch_size = 32 if not batch_size else int(batch_size)
+
+        # testcases may be any iterable, it is pulled in pages as the queue
+        # drains and mutation sidecars are read when an item is popped
+        page_size = getenv('PAGE_SIZE')
+        self.page_size = 1000 if not page_size else int(page_size)
+        if self.page_size < 1:
+            raise ValueError(f'PAGE_SIZE must be at least 1, not {self.page_size}')
+
+        # k of the k-ary bisection, (html_file, vers) -> probes of its
+        # current round, items popped for k-ary splitting and not split yet
+        self.kary = 2
+        self.__probes = {}
+        self.__probeqs = defaultdict(Queue)
+        self.__splitting = 0
+
+        # Optional QueueStore, thread -> html files it popped last
+        self.store = store
+        self.__running = defaultdict(list)
+        max_attempts = getenv('MAX_ATTEMPTS')
+        self.max_attempts = 3 if not max_attempts else int(max_attempts)
+
+        # Streaming pipeline, outputs are forwarded to the downstream queue
+        # and the queue is closed once its upstream stage has finished.
+        self.downstream = None
+        self.closed = Event()
+        self.closed.set()
+        # findings are copied here before they are forwarded, see update_postq
+        self.forward_dir = None
+
         self.monitor = defaultdict(float)
+        self.settle_stats = defaultdict(float)
+        # oracle calls of the minimized testcases
+        self.min_stats = defaultdict(int)
+        # shared by the Minimizer threads of this queue
+        self.coordinator = ReductionCoordinator()
+
+        # TestcaseServer, BrowserPool and OracleCache shared by every
+        # thread, all are set by Metamong.process.
+        self.server = None
+        self.pool = None
+        self.oracle_cache = None
+
+        # html file -> structure written by the generator, see read_manifests
+        self.manifests = {}
+        # CorpusSet, its findings are written to disk
+        self.corpus = corpus
+
+        # Generated testcases that are no findings are removed from the
+        # spool directory once tested.
+        self.spool = None
+        self.__found = set()
 
         self.revlist = revision_range
         for rev in self.revlist:
             self.__download_locks[rev] = Lock()
 
-        vers = (self.revlist[0], self.revlist[-1])
-        for testcase in testcases:
-            js = testcase.replace('.html', '.js')
-            muts = FileManager.read_js_file(js) if exists(js) else []
-            self.insert_to_queue(vers, testcase, muts)
+        self.__source = iter(testcases)
+        self.__fill_page()
 
         self.start_time = time.time()
 
+    def stage_queue(self):
+        # An empty, open queue sharing the browser builds, server and pool.
+        q = copy.copy(self)
+        q.__queue_lock = Lock()
+        q.__preqs = defaultdict(Queue)
+        q.__postqs = defaultdict(Queue)
+        q.__vers = None
+        q.__probes = {}
+        q.__probeqs = defaultdict(Queue)
+        q.__splitting = 0
+        q.__running = defaultdict(list)
+        # the inputs of a stage are forwarded by its upstream stage, never
+        # paged from the source of the first one
+        q.__source = None
+        q.num_of_valid_tests = 0
+        q.num_of_tests = 0
+        q.num_of_inputs = 0
+        q.num_of_outputs = 0
+        q.sched_stats = defaultdict(int)
+        q.monitor = defaultdict(float)
+        q.settle_stats = defaultdict(float)
+        q.min_stats = defaultdict(int)
+        q.coordinator = ReductionCoordinator()
+        q.store = None
+        q.spool = None
+        q.__found = set()
+        q.downstream = None
+        q.forward_dir = None
+        q.closed = Event()
+        q.start_time = time.time()
+        return q
+
+    def wait_for_input(self) -> bool:
+        # True if a thread that found the queue empty should poll again.
+        if not self.closed.wait(0.5): return True
+        return self.left() > 0
+
     def reset_lock(self):
         if self.__queue_lock.locked():
             self.__queue_lock.release()
@@ -175,41 +272,254 @@ class IOQueue:
         key =  choice(keys) if keys else None
         return key
 
+    def __select_sticky(self, prefer: Tuple[int, int, int]) -> Tuple[int, int, int]:
+        if prefer in self.__preqs:
+            # the shared version would have restarted this thread's browsers
+            if prefer != self.__vers:
+                self.sched_stats['avoided'] += 1
+            return prefer
+
+        # migrate to the largest bucket to amortize the restart
+        self.sched_stats['migrated'] += 1
+        return max(self.__preqs, key=lambda vers: self.__preqs[vers].qsize())
+
+    def read_muts(self, html_file: str) -> list:
+        js = html_file.replace('.html', '.js')
+        if exists(js): return FileManager.read_js_file(js)
+        if self.corpus and self.corpus.has(html_file):
+            return self.corpus.read_js(html_file)
+        return []
+
+    def read_testcase(self, html_file: str) -> str:
+        if self.corpus and not exists(html_file) and self.corpus.has(html_file):
+            return self.corpus.read(html_file)
+        return FileManager.read_file(html_file)
+
+    def get_manifest(self, html_file: str) -> Optional[dict]:
+        dic = self.manifests.get(abspath(html_file))
+        if dic is None and self.corpus and self.corpus.has(html_file):
+            dic = self.corpus.manifest(html_file)
+        if dic is None: return
+        # same as analyze_html, a testcase without ids or rules is skipped
+        return dic if all(dic.values()) else {}
+
     def count_valid_test(self) -> None:
         self.num_of_valid_tests += 1
 
     def insert_to_queue(self, vers: Tuple[int, int, int], html_file: str, muts: list) -> None:
         with acquire_timeout(self.__queue_lock, -1) as acquired:
             if not acquired: return 
-            value = [html_file, muts]
-            self.__preqs[vers].put(value)
-            self.num_of_inputs += 1
+            self.__put(vers, html_file, muts)
 
-            if not self.__vers: 
-                self.__vers = self.__select_vers()
+    def __put(self, vers: Tuple[int, int, int], html_file: str, muts: Optional[list]) -> None:
+        # muts is None until the sidecar of a paged testcase is read
+        value = [html_file, muts]
+        self.__preqs[vers].put(value)
+        self.num_of_inputs += 1
+        if self.store and self.store.stage:
+            self.store.add('in', vers, html_file, muts)
+
+        if not self.__vers: 
+            self.__vers = self.__select_vers()
 
-    def pop_from_queue(self, use_limit=True) -> Optional[list]:
+    def __fill_page(self, drain: bool = False) -> None:
+        # Pulls the next page once less than half a page is queued.
+        if self.__source is None: return
+        if not drain and self.__num_of_queued() >= max(1, self.page_size // 2): return
+
+        vers = (self.revlist[0], self.revlist[-1])
+        num = None if drain else self.page_size
+        pulled = 0
+        for testcase in islice(self.__source, num):
+            self.__put(vers, testcase, None)
+            pulled += 1
+        if drain or pulled < self.page_size:
+            self.__source = None
+
+    def __num_of_queued(self) -> int:
+        return sum(q.qsize() for q in self.__preqs.values())
+
+    def __load_muts(self, value: list) -> None:
+        if value[1] is None:
+            value[1] = self.read_muts(value[0])
+
+    def is_paging(self) -> bool:
+        return self.__source is not None
+
+    def __track_running(self, html_files: list) -> None:
+        # A thread pops its next item only after finishing the previous one.
+        if not self.store and not self.spool: return
+        running = self.__running[current_thread()]
+        for html_file in running:
+            if any(key[0] == html_file for key in self.__probes): continue
+            if self.store: self.store.finish(html_file)
+            if self.spool: self.__release(html_file)
+        running.clear()
+        for html_file in html_files:
+            if self.store: self.store.start(html_file)
+            running.append(html_file)
+
+    def __release(self, html_file: str) -> None:
+        if html_file in self.__found: return
+        if dirname(html_file) != self.spool: return
+        self.manifests.pop(abspath(html_file), None)
+        if exists(html_file): remove(html_file)
+
+    def pop_from_queue(self, use_limit=True, prefer=None, split=False) -> Optional[list]:
+        # split: the item is passed to split_probes, it counts as in flight
+        # until then
         with acquire_timeout(self.__queue_lock, 1000) as acquired:
             if not acquired: return 
+            self.__track_running([])
+            self.__fill_page()
             value = None
             if not self.__vers: 
                 return
             if use_limit and self.num_of_outputs >= self.limit:
                 self.__preqs.clear()
+                self.__source = None
                 self.__vers = self.__select_vers()
                 return 
         
             vers = self.__vers
+            if self.sticky and prefer is not None:
+                vers = self.__select_sticky(prefer)
             value = self.__preqs[vers].get()
             if self.__preqs[vers].empty():
                 self.__preqs.pop(vers)
-                self.__vers = self.__select_vers()
+                if vers == self.__vers:
+                    self.__vers = self.__select_vers()
+            self.__track_running([value[0]])
+            if split: self.__splitting += 1
             self.num_of_tests += 1
             if self.num_of_tests % 100 == 0:
                 tt = round((time.time() - self.start_time) / 60, 3)
                 ot = round(self.num_of_tests / tt, 3)
                 printf('BLUE', f'test: {self.num_of_tests}, outputs: {self.num_of_outputs}, time: {tt}, test / time: {ot}, valid: {self.num_of_valid_tests}')
-            return value, vers
+
+        # sidecars are read outside the lock, the item is ours now
+        self.__load_muts(value)
+        return value, vers
+
+    def __get_probe(self, vers: Tuple[int, int]):
+        # The revision the Bisecter tests next for this interval, or the
+        # interval itself once both ends are adjacent.
+        start_idx = bisect.bisect_left(self.revlist, vers[0])
+        end_idx = bisect.bisect_left(self.revlist, vers[1])
+        if end_idx - start_idx < 2:
+            return vers
+        return self.revlist[(start_idx + end_idx) // 2]
+
+    def pop_probe_group(self, use_limit=True, prefer=None) -> Optional[tuple]:
+        with acquire_timeout(self.__queue_lock, 1000) as acquired:
+            if not acquired: return
+            self.__fill_page()
+            if not self.__vers:
+                self.__track_running([])
+                return
+            if use_limit and self.num_of_outputs >= self.limit:
+                self.__preqs.clear()
+                self.__source = None
+                self.__vers = self.__select_vers()
+                return
+
+            self.__track_running([])
+            groups = defaultdict(list)
+            for vers in self.__preqs:
+                groups[self.__get_probe(vers)].append(vers)
+
+            if prefer in groups:
+                probe = prefer
+            else:
+                size = lambda p: sum(self.__preqs[vers].qsize() for vers in groups[p])
+                probe = max(groups, key=size)
+
+            items = []
+            for vers in groups[probe]:
+                q = self.__preqs[vers]
+                while not q.empty() and len(items) < self.batch_size:
+                    items.append((q.get(), vers))
+                if q.empty():
+                    self.__preqs.pop(vers)
+
+            if self.__vers not in self.__preqs:
+                self.__vers = self.__select_vers()
+
+            self.__track_running([value[0] for value, _ in items])
+            self.num_of_tests += len(items)
+            self.sched_stats['groups'] += 1
+            self.sched_stats['grouped'] += len(items)
+
+        for value, _ in items:
+            self.__load_muts(value)
+        return probe, items
+
+    def split_probes(self, vers: Tuple[int, int], html_file: str, muts: list) -> bool:
+        with acquire_timeout(self.__queue_lock, 1000) as acquired:
+            if not acquired: return False
+            self.__splitting = max(0, self.__splitting - 1)
+            start_idx = bisect.bisect_left(self.revlist, vers[0])
+            end_idx = bisect.bisect_left(self.revlist, vers[1])
+            if end_idx - start_idx < 2: return False
+
+            # share the k - 1 probes among the testcases being bisected
+            active = len(self.__probes) + 1
+            num = max(1, (self.kary - 1) // active)
+            width = end_idx - start_idx
+            indices = set()
+            for i in range(1, num + 1):
+                idx = start_idx + round(i * width / (num + 1))
+                if start_idx < idx < end_idx: indices.add(idx)
+
+            revs = [self.revlist[idx] for idx in sorted(indices)]
+            # an inconclusive bisection step queues two intervals of a file
+            key = (html_file, tuple(vers))
+            self.__probes[key] = {'vers': vers, 'results': {}, 'pending': len(revs)}
+            for rev in revs:
+                self.__probeqs[rev].put((key, muts))
+            self.sched_stats['probes'] += len(revs)
+            return True
+
+    def pop_probe_task(self, prefer=None) -> Optional[tuple]:
+        with acquire_timeout(self.__queue_lock, 1000) as acquired:
+            if not acquired: return
+            if not self.__probeqs: return
+            if prefer in self.__probeqs: rev = prefer
+            else: rev = max(self.__probeqs, key=lambda r: self.__probeqs[r].qsize())
+
+            key, muts = self.__probeqs[rev].get()
+            if self.__probeqs[rev].empty():
+                self.__probeqs.pop(rev)
+            self.num_of_tests += 1
+            return rev, key, muts
+
+    def report_probe(self, key: tuple, rev: int, is_bug: Optional[bool]) -> Optional[tuple]:
+        # key: (html_file, vers) of the probe task
+        with acquire_timeout(self.__queue_lock, 1000) as acquired:
+            if not acquired: return
+            entry = self.__probes.get(key)
+            # a stale probe
+            if entry is None: return
+            entry['results'][rev] = is_bug
+            entry['pending'] -= 1
+            if entry['pending']: return
+            self.__probes.pop(key)
+
+            # the regression lies between the last clean and the first
+            # buggy revision, invalid probes are skipped
+            start, end = entry['vers']
+            results = entry['results']
+            points = [(start, False)]
+            points += sorted((r, results[r]) for r in results if results[r] is not None)
+            points.append((end, True))
+            for i in range(1, len(points)):
+                if points[i][1]:
+                    return entry['vers'], (points[i - 1][0], points[i][0])
+
+    def probes_in_flight(self) -> bool:
+        with acquire_timeout(self.__queue_lock, 1000) as acquired:
+            if not acquired: return False
+            return len(self.__probes) > 0 or self.__splitting > 0
 
     def get_vers(self) -> Optional[Tuple[int, int, int]]:
         with acquire_timeout(self.__queue_lock, 1000) as acquired:
@@ -218,15 +528,37 @@ class IOQueue:
             return vers
 
     def update_postq(self, vers: Tuple[int, int, int], html_file: str, muts: list) -> None:
+        if self.corpus and self.corpus.has(html_file):
+            self.corpus.materialize(html_file)
+        found = html_file
+        if self.downstream and self.forward_dir:
+            html_file = self.__forward(html_file, muts)
         with acquire_timeout(self.__queue_lock, 1000) as acquired:
             if not acquired: return 
             self.__postqs[vers].put((html_file, muts))
             self.num_of_outputs += 1
+            if self.spool: self.__found.add(found)
+            if self.store:
+                self.store.add('out', vers, html_file, muts)
             if self.num_of_outputs % 20 == 0:
                 tt = round((time.time() - self.start_time) / 60, 3)
                 ot = round(self.num_of_tests / tt, 3)
                 printf('GREEN', f'test: {self.num_of_tests}, outputs: {self.num_of_outputs}, time: {tt}, test / time: {ot}')
 
+        if self.downstream:
+            self.downstream.insert_to_queue(vers, html_file, muts)
+
+    def __forward(self, html_file: str, muts: list) -> str:
+        # The downstream stage works on a copy in this stage's output
+        # directory, like the staged pipeline does after dump_queue.
+        Path(self.forward_dir).mkdir(parents=True, exist_ok=True)
+        name = basename(html_file)
+        new_html_file = join(self.forward_dir, name)
+        if abspath(new_html_file) != abspath(html_file):
+            FileManager.write_file(new_html_file, self.read_testcase(html_file))
+        FileManager.write_file(join(self.forward_dir, name.replace('.html', '.js')), '\n'.join(muts))
+        return new_html_file
+
     def move_to_preqs(self):
         with acquire_timeout(self.__queue_lock, 1000) as acquired:
             if not acquired: return 
@@ -238,6 +570,42 @@ class IOQueue:
             self.num_of_tests = 0
             self.num_of_outputs = 0
 
+    def checkpoint(self, stage: str) -> None:
+        # Persists the pending queue as the inputs of the given stage.
+        if not self.store: return
+        with acquire_timeout(self.__queue_lock, 1000) as acquired:
+            if not acquired: return
+            self.__fill_page(drain=True)
+            self.store.stage = stage
+            for vers in self.__preqs:
+                for html_file, muts in list(self.__preqs[vers].queue):
+                    self.store.add('in', vers, html_file, muts, commit=False)
+            self.store.commit()
+
+    def complete_stage(self, next_stage: str) -> None:
+        if not self.store: return
+        with acquire_timeout(self.__queue_lock, 1000) as acquired:
+            if not acquired: return
+            self.__running.clear()
+            self.store.complete_stage(commit=False)
+        self.checkpoint(next_stage)
+
+    def restore(self, stage: str) -> None:
+        # Reloads an interrupted stage: unfinished inputs and its outputs.
+        self.store.stage = stage
+        inputs = self.store.load('in', self.max_attempts)
+        outputs = self.store.load('out')
+        with acquire_timeout(self.__queue_lock, 1000) as acquired:
+            if not acquired: return
+            for vers, html_file, muts in inputs:
+                self.__preqs[vers].put([html_file, muts])
+            for vers, html_file, muts in outputs:
+                self.__postqs[vers].put((html_file, muts))
+            self.num_of_inputs = len(inputs)
+            self.num_of_outputs = len(outputs)
+            self.__vers = self.__select_vers()
+        printf('BLUE', f'resuming {stage}: {len(inputs)} inputs, {len(outputs)} outputs')
+
     def dump_queue(self, dir_path):
         with acquire_timeout(self.__queue_lock, 1000) as acquired:
             if not acquired: return 
@@ -251,7 +619,9 @@ class IOQueue:
                     html_file, muts = q.get()
                     name = basename(html_file)
                     new_html_file = join(dir_path, name)
-                    copyfile(html_file, new_html_file)
+                    # forwarded findings are already there
+                    if abspath(new_html_file) != abspath(html_file):
+                        copyfile(html_file, new_html_file)
                     new_js_file = join(dir_path, name.replace('.html', '.js'))
                     FileManager.write_file(new_js_file, '\n'.join(muts))
                     q.put((new_html_file, muts))
@@ -334,6 +704,43 @@ class IOQueue:
                     br.kill_browser_by_pid()
 
 
+    def record_settle(self, stats):
+        with acquire_timeout(self.__queue_lock, 1000) as acquired:
+            if not acquired: return
+            for key in ('count', 'total', 'timeout'):
+                self.settle_stats[key] += stats[key]
+            self.settle_stats['max'] = max(self.settle_stats['max'], stats['max'])
+
+    def record_minimization(self, oracle_calls: int) -> None:
+        with acquire_timeout(self.__queue_lock, 1000) as acquired:
+            if not acquired: return
+            self.min_stats['count'] += 1
+            self.min_stats['calls'] += oracle_calls
+            self.min_stats['max'] = max(self.min_stats['max'], oracle_calls)
+
+    def minimize_summary(self):
+        stats = self.min_stats
+        if not stats['count']: return ''
+        avg = round(stats['calls'] / stats['count'], 2)
+        return f"minimized: {stats['count']}, oracle calls: {stats['calls']}, avg: {avg}, max: {stats['max']}"
+
+    def settle_summary(self):
+        stats = self.settle_stats
+        if not stats['count']: return ''
+        avg = round(stats['total'] / stats['count'], 2)
+        return f"settles: {int(stats['count'])}, avg: {avg}ms, max: {round(stats['max'], 2)}ms, timeouts: {int(stats['timeout'])}"
+
+    def schedule_summary(self):
+        stats = self.sched_stats
+        summary = []
+        if self.sticky:
+            summary.append(f"restarts avoided: {stats['avoided']}, migrations: {stats['migrated']}")
+        if stats['probes']:
+            summary.append(f"k-ary probes: {stats['probes']}")
+        if stats['groups']:
+            summary.append(f"probe groups: {stats['groups']}, testcases per group: {round(stats['grouped'] / stats['groups'], 2)}")
+        return ', '.join(summary)
+
     def left(self):
         left = 0
         with acquire_timeout(self.__queue_lock, 1000) as acquired:
@@ -345,7 +752,9 @@ class IOQueue:
 
 class FileManager:
     def get_all_files(root, ext='', exclude='') -> list:
-        paths = []
+        return list(FileManager.iter_files(root, ext, exclude))
+
+    def iter_files(root, ext='', exclude=''):
         for path, subdirs, files in walk(root):
             for name in files:
                 if ext and ext not in name:
@@ -353,8 +762,18 @@ class FileManager:
 
                 if exclude and exclude in name:
                     continue
-                paths.append((join(path, name)))
-        return paths
+                yield join(path, name)
+
+    def remove_expected_files(*roots) -> int:
+        # Left behind by older runs which rendered the expected page from
+        # disk, next to the testcases of the input and of every stage
+        # directory of the output.
+        paths = set()
+        for root in roots:
+            if root: paths.update(FileManager.get_all_files(root, '_expected.html'))
+        for path in paths:
+            remove(path)
+        return len(paths)
 
     def get_parent_dir(file):
         return dirname(dirname(abspath(file)))
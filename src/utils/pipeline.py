@@ -0,0 +1,213 @@
+import time
+
+from os import environ
+from os.path import join
+from datetime import timedelta
+
+from utils.pool import BrowserPool
+from utils.server import TestcaseServer
+from utils.cache import OracleCache
+from utils.analyzer import read_manifests
+from utils.helper import FileManager
+
+# Orchestration shared by metamong.py and modules.py: the server, browser
+# pool and oracle cache shared by every thread of an IOQueue, and the runs
+# of the testers, one stage after the other (PIPELINE=stage) or all at once
+# (PIPELINE=stream). A front end sets self.ioq and calls these from its
+# process().
+class Pipeline:
+    def __init__(self, input_dir: str, output_dir: str, num_of_threads: int,
+                 browser_type: str) -> None:
+
+        self.in_dir = input_dir
+        self.out_dir = output_dir
+        self.num_of_threads = num_of_threads
+        self.browser_type = browser_type
+
+        self.ioq = None
+        self.experiment_result = {}
+        self.tester = []
+        self.report = []
+
+        # a stage whose queue is drained kills the browsers of the threads
+        # still alive and ends
+        self.kill_stragglers = False
+
+    def new_thread(self, test_class: object, id_: int, ioq):
+        return test_class(id_, ioq, self.browser_type)
+
+    def remove_stale_files(self) -> None:
+        removed = FileManager.remove_expected_files(self.in_dir, self.out_dir)
+        if removed: print (f'removed {removed} stale *_expected.html files')
+
+    def start_services(self, corpus, pool_max: int) -> None:
+        self.ioq.manifests.update(read_manifests(self.in_dir))
+        if self.ioq.manifests: print (f'# of manifest entries: {len(self.ioq.manifests)}')
+        self.ioq.server = TestcaseServer([self.in_dir, self.out_dir])
+        self.ioq.server.start()
+        self.ioq.corpus = self.ioq.server.corpus = corpus
+
+        pool_max = int(environ.get('POOL_MAX', pool_max))
+        pool_idle = float(environ.get('POOL_IDLE', '300'))
+        self.ioq.pool = BrowserPool(pool_max, pool_idle, self.ioq.server)
+
+        # ORACLE_CACHE results kept in memory (0: none), ORACLE_DB adds a
+        # SQLite file that later runs reuse
+        cache_size = int(environ.get('ORACLE_CACHE', '4096'))
+        cache_db = environ.get('ORACLE_DB')
+        if cache_size or cache_db:
+            self.ioq.oracle_cache = OracleCache(cache_size, cache_db)
+
+    def stop_services(self) -> None:
+        self.ioq.pool.close()
+        if self.ioq.oracle_cache: self.ioq.oracle_cache.close()
+        self.ioq.server.stop()
+        if self.ioq.corpus: self.ioq.corpus.close()
+        if self.ioq.store: self.ioq.store.close()
+
+    def run(self, tester: list, stream: bool, start: float) -> None:
+        # start: when process() started, for the total time
+        if stream and tester:
+            self.test_pipeline(tester)
+        else:
+            for test in tester:
+                self.test_wrapper(test)
+
+        elapsed = time.time() - start
+        self.experiment_result['TOTAL TIME'] = str(timedelta(seconds=elapsed))
+
+        if self.report:
+            self.ioq.dump_queue_with_sort(join(self.out_dir, 'Report'))
+            for test in self.report:
+                self.test_wrapper(test, True)
+
+    def print_summary(self, q) -> None:
+        settle = q.settle_summary()
+        if settle: print (settle)
+        schedule = q.schedule_summary()
+        if schedule: print (schedule)
+        minimize = q.minimize_summary()
+        if minimize: print (minimize)
+
+    def test_wrapper(self, test_class: object, report: bool = False) -> None:
+        start = time.time()
+        threads = []
+        for i in range(self.num_of_threads):
+            threads.append(self.new_thread(test_class, i, self.ioq))
+            threads[-1].saveshot = report
+
+        class_name = type(threads[-1]).__name__
+        print (f'{class_name} stage starts...')
+
+        for th in threads:
+            th.start()
+
+        num_th = len(threads)
+        alive = num_th
+        while True:
+            self.ioq.monitoring()
+            self.ioq.pool.evict_idle()
+            time.sleep(1)
+
+            alive = 0
+            for th in threads:
+                if th.is_alive(): alive += 1
+
+            if alive == 0: break
+
+            if alive < num_th:
+                left = self.ioq.left()
+                print (f'{alive} of {num_th} Threads are alive, {left} inputs are left...')
+                if left == 0 and self.kill_stragglers:
+                    for th in threads:
+                        if not th.is_alive(): continue
+                        for br in th.br_list:
+                            br.kill_browser_by_pid()
+                    time.sleep(10)
+                    break
+
+
+        self.ioq.reset_lock()
+        elapsed = time.time() - start
+        elapsed_time = str(timedelta(seconds=elapsed))
+        print (f'{class_name} stage ends...', elapsed_time)
+        self.print_summary(self.ioq)
+        print (f'browser pool: {self.ioq.pool.summary()}')
+        if self.ioq.oracle_cache: print (f'oracle cache: {self.ioq.oracle_cache.summary()}')
+
+        if not report:
+            self.experiment_result[class_name] = [self.ioq.num_of_outputs, elapsed_time]
+        self.ioq.move_to_preqs()
+        if not report:
+            dir_path = join(self.out_dir, class_name)
+            self.ioq.dump_queue(dir_path)
+
+            index = self.tester.index(test_class)
+            next_stage = 'Report'
+            if index + 1 < len(self.tester):
+                next_stage = self.tester[index + 1].__name__
+            self.ioq.complete_stage(next_stage)
+
+    def get_workers(self, tester: list) -> dict:
+        # WORKERS=Fuzzer:6,Minimizer:2 allocates threads per stage, by default
+        # the first stage gets all of them and the later ones one each.
+        workers = {test.__name__: 1 for test in tester}
+        workers[tester[0].__name__] = self.num_of_threads
+        for entry in environ.get('WORKERS', '').split(','):
+            if ':' not in entry: continue
+            name, num = entry.split(':')
+            workers[name.strip()] = max(1, int(num))
+        return workers
+
+    def test_pipeline(self, tester: list) -> None:
+        # Every stage runs at once and a finding flows to the next stage as
+        # soon as it is found; a stage ends when its input is drained and
+        # the stage before it has ended.
+        start = time.time()
+        workers = self.get_workers(tester)
+        queues = [self.ioq] + [self.ioq.stage_queue() for _ in tester[1:]]
+        for q, next_q, test_class in zip(queues, queues[1:], tester):
+            q.downstream = next_q
+            q.forward_dir = join(self.out_dir, test_class.__name__)
+
+        stages = []
+        id_ = 0
+        for test_class, q in zip(tester, queues):
+            threads = []
+            for _ in range(workers[test_class.__name__]):
+                threads.append(self.new_thread(test_class, id_, q))
+                threads[-1].saveshot = False
+                id_ += 1
+            stages.append(threads)
+            print (f'{test_class.__name__} stage starts with {len(threads)} threads...')
+
+        for threads in stages:
+            for th in threads:
+                th.start()
+
+        ended = [False] * len(stages)
+        while not all(ended):
+            for q in queues:
+                q.monitoring()
+            self.ioq.pool.evict_idle()
+            time.sleep(1)
+
+            for i, threads in enumerate(stages):
+                if ended[i]: continue
+                if any(th.is_alive() for th in threads): continue
+                ended[i] = True
+
+                q = queues[i]
+                class_name = tester[i].__name__
+                elapsed_time = str(timedelta(seconds=time.time() - start))
+                print (f'{class_name} stage ends...', elapsed_time)
+                self.print_summary(q)
+
+                self.experiment_result[class_name] = [q.num_of_outputs, elapsed_time]
+                if q.downstream: q.downstream.closed.set()
+                q.move_to_preqs()
+                q.dump_queue(join(self.out_dir, class_name))
+
+        print (f'browser pool: {self.ioq.pool.summary()}')
+        if self.ioq.oracle_cache: print (f'oracle cache: {self.ioq.oracle_cache.summary()}')
+        self.ioq = queues[-1]
@@ -0,0 +1,150 @@
+import time
+
+from os import environ
+from threading import Condition
+from collections import defaultdict
+
+from pyvirtualdisplay import Display
+
+from utils.driver import Browser
+from utils.helper import printf
+
+
+class BrowserPool:
+    def __init__(self, max_instances: int = 0, idle_timeout: float = 300, server = None) -> None:
+        self.__cond = Condition()
+
+        # key -> [(browser, time of checkin)], most recently used last
+        self.__idle = defaultdict(list)
+        self.__num_of_instances = 0
+        self.__displays = {}
+
+        # 0 means no cap
+        self.max_instances = max_instances
+        self.idle_timeout = idle_timeout
+        self.server = server
+
+        self.stats = defaultdict(int)
+
+    def __get_key(self, browser_type: str, version: int, flags: str, popup: bool, vid: str) -> tuple:
+        return (browser_type, version, flags, popup, vid)
+
+    def __pop_idle(self, key: tuple):
+        idle = self.__idle.get(key)
+        if not idle: return
+        br, _ = idle.pop()
+        if not idle: self.__idle.pop(key)
+        return br
+
+    def __pop_lru(self):
+        lru_key = None
+        lru_time = None
+        for key in self.__idle:
+            since = self.__idle[key][0][1]
+            if lru_time is None or since < lru_time:
+                lru_key, lru_time = key, since
+        if lru_key is None: return
+
+        idle = self.__idle[lru_key]
+        br, _ = idle.pop(0)
+        if not idle: self.__idle.pop(lru_key)
+        return br
+
+    def get_display(self, id_: int) -> str:
+        # Pooled browsers outlive a stage, so do the displays they run on.
+        with self.__cond:
+            if id_ not in self.__displays:
+                if environ.get('DEBUG'):
+                    vdisplay = Display(size=(1600, 1200), backend="xvnc", rfbport=id_ + 5900)
+                else:
+                    vdisplay = Display(size=(1600, 1200))
+                vdisplay.start()
+                self.__displays[id_] = vdisplay
+            return self.__displays[id_].new_display_var
+
+    def checkout(self, browser_type: str, version: int, flags: str = '',
+                 popup: bool = False, vid: str = ''):
+        key = self.__get_key(browser_type, version, flags, popup, vid)
+        waited = False
+        while True:
+            evicted = None
+            with self.__cond:
+                br = self.__pop_idle(key)
+                if br is None:
+                    cap = self.max_instances
+                    if cap and self.__num_of_instances >= cap:
+                        evicted = self.__pop_lru()
+                        if evicted is None and not waited:
+                            self.__cond.wait(timeout=30)
+                            waited = True
+                            continue
+                        elif evicted is None:
+                            printf('WARNING', f'BrowserPool is over its cap of {cap} instances')
+                            self.__num_of_instances += 1
+                        else:
+                            self.stats['evicted'] += 1
+                    else:
+                        self.__num_of_instances += 1
+
+            if br is not None:
+                # health check, the instance may have crashed while idle
+                if br.is_alive():
+                    self.stats['reused'] += 1
+                    return br
+                self.discard(br)
+                continue
+
+            if evicted is not None:
+                evicted.kill_browser()
+
+            br = Browser(browser_type, version, flags, popup=popup, vid_=vid, server=self.server)
+            br.pool_key = key
+            self.stats['launched'] += 1
+            if not br.setup_browser():
+                self.discard(br)
+                return
+            return br
+
+    def checkin(self, br: Browser) -> None:
+        if not br.browser or not br.browser.session_id:
+            self.discard(br)
+            return
+
+        with self.__cond:
+            self.__idle[br.pool_key].append((br, time.time()))
+            self.__cond.notify()
+
+    def discard(self, br: Browser) -> None:
+        br.kill_browser()
+        with self.__cond:
+            self.__num_of_instances -= 1
+            self.__cond.notify()
+
+    def evict_idle(self) -> None:
+        expired = []
+        cur_time = time.time()
+        with self.__cond:
+            for key in list(self.__idle.keys()):
+                idle = self.__idle[key]
+                while idle and cur_time - idle[0][1] > self.idle_timeout:
+                    expired.append(idle.pop(0)[0])
+                if not idle: self.__idle.pop(key)
+            self.stats['evicted'] += len(expired)
+
+        for br in expired:
+            self.discard(br)
+
+    def close(self) -> None:
+        with self.__cond:
+            idle = [br for key in self.__idle for br, _ in self.__idle[key]]
+            self.__idle.clear()
+            displays = list(self.__displays.values())
+            self.__displays.clear()
+
+        for br in idle:
+            self.discard(br)
+        for vdisplay in displays:
+            vdisplay.stop()
+
+    def summary(self) -> str:
+        return ', '.join(f'{key}: {self.stats[key]}' for key in ('launched', 'reused', 'evicted'))
@@ -0,0 +1,239 @@
+import os
+
+from typing import Optional, Tuple
+from shutil import copyfile
+from os.path import basename, join, dirname
+
+from utils.helper import FileManager
+from utils.helper import printf
+from utils.ddmin import ddmin, first_in_order
+from utils.transform import get_depths, get_attributes, get_style, set_style
+from utils.css import parse_stylesheet, serialize_stylesheet, rule_paths, get_rule
+from utils.css import remove_rules, remove_selectors, remove_declarations
+from utils.transform import remove_elements, remove_attributes, clear_text, unwrap
+
+# The minimization loop of minimizer.Minimizer and modules.Minimizer. A
+# subclass is a Thread with self.helper (an IOQueue) and provides
+# start_browsers(vers) and oracle(html_file, muts, use_cache), the test that
+# tells whether a candidate still reproduces.
+class Reducer:
+    def __init__(self, help_tag: str) -> None:
+        # help_tag names the files this thread writes as a helper of
+        # another Minimizer, see ReductionCoordinator
+        self.__help_tag = help_tag
+
+        self.__min_html = None
+        self.__html_file = None
+        self.__temp_file = None
+        self.__trim_file = None
+        self.__muts = None
+        self.__oracle_calls = 0
+        self.__vers = None
+
+    def __remove_temp_files(self):
+        os.remove(self.__temp_file)
+        os.remove(self.__trim_file)
+
+    def __test(self, html_file: str, muts: list, use_cache: bool = True) -> bool:
+        self.__oracle_calls += 1
+        return self.oracle(html_file, muts, use_cache)
+
+    def __initial_test(self, html_file: str, muts: list):
+
+        self.__html_file = html_file
+        self.__oracle_calls = 0
+        self.__trim_file = join(dirname(html_file),
+                'trim' + basename(html_file))
+        self.__temp_file = join(dirname(html_file),
+                'temp' + basename(html_file))
+
+        # a corpus entry may not be materialized
+        self.__min_html = self.helper.read_testcase(html_file)
+        FileManager.write_file(self.__trim_file, self.__min_html)
+        FileManager.write_file(self.__temp_file, self.__min_html)
+        # the mutations travel with the queue item, a forwarded finding
+        # may have no sidecar yet
+        self.__muts = list(muts)
+        # revalidated, the finding may be flaky
+        return self.__test(html_file, self.__muts, use_cache=False)
+
+    def __minimize_style(self):
+        # ddmin over the rules of the first <style>, then their selectors,
+        # then their declarations. Rules from a 'DO NOT REMOVE' line on are
+        # kept as they are.
+        base = FileManager.read_file(self.__temp_file)
+        css = get_style(base)
+        if not css: return
+
+        lines = css.split('\n')
+        fixed = next((i for i, line in enumerate(lines) if 'DO NOT REMOVE' in line), len(lines))
+        sheet = parse_stylesheet('\n'.join(lines[:fixed]))
+        tail = '\n'.join(lines[fixed:])
+
+        def build(rules: Optional[list]) -> Optional[str]:
+            if rules is None: return
+            return set_style(base, '\n' + serialize_stylesheet(rules) + tail)
+
+        def reduce(items: list, remove) -> None:
+            nonlocal sheet
+            kept = set(self.__reduce(items, lambda removed: build(remove(sheet, removed))))
+            removed = [x for x in items if x not in kept]
+            if removed: sheet = remove(sheet, removed)
+
+        depth = 1
+        while True:
+            paths = [path for path in rule_paths(sheet) if len(path) == depth]
+            if not paths: break
+            reduce(paths, remove_rules)
+            depth += 1
+
+        paths = rule_paths(sheet)
+        reduce([(path, j) for path in paths
+                for j in range(len(get_rule(sheet, path).selectors or []))], remove_selectors)
+        reduce([(path, j) for path in paths
+                for j in range(len(get_rule(sheet, path).declarations or []))], remove_declarations)
+
+    def __test_candidate(self, text: Optional[str]) -> bool:
+        if not text: return False
+        FileManager.write_file(self.__trim_file, text)
+        return self.__test(self.__trim_file, self.__muts)
+
+    def __evaluate(self, vers: Tuple[int, int], candidate: tuple) -> bool:
+        # Runs on the owner and on helping threads, see ReductionCoordinator
+        html_file, text, muts = candidate
+        if not text: return False
+        if self.__vers != vers:
+            self.__vers = vers
+            if not self.start_browsers(vers):
+                self.__vers = None
+                return False
+
+        trim_file = self.__trim_file
+        if html_file != self.__html_file:
+            trim_file = join(dirname(html_file), f'help{self.__help_tag}_' + basename(html_file))
+        FileManager.write_file(trim_file, text)
+        passed = self.oracle(trim_file, muts)
+        if trim_file != self.__trim_file: os.remove(trim_file)
+        return passed
+
+    def __reduce(self, items: list, build) -> list:
+        # ddmin over items, build(removed) returns the temp file without them,
+        # the items kept are returned
+        passed = {}
+        def removed(kept: list) -> list:
+            kept = set(kept)
+            return [x for x in items if x not in kept]
+
+        def test(kept: list) -> bool:
+            text = build(removed(kept))
+            if not self.__test_candidate(text): return False
+            passed['text'] = text
+            return True
+
+        def first(configs: list) -> Optional[int]:
+            coordinator = self.helper.coordinator
+            if not coordinator.helpers:
+                return first_in_order(test)(configs)
+
+            texts = [build(removed(config)) for config in configs]
+            candidates = [(self.__html_file, text, self.__muts) for text in texts]
+            i, calls = coordinator.first_passing(self.__vers, candidates, self.__evaluate)
+            self.__oracle_calls += calls
+            if i is not None: passed['text'] = texts[i]
+            return i
+
+        kept = ddmin(items, test, first)
+        if len(kept) == len(items): return kept
+        self.__min_html = passed['text']
+        FileManager.write_file(self.__temp_file, self.__min_html)
+        return kept
+
+    def __minimize_dom(self):
+        # Hierarchical delta debugging: the elements of one depth are reduced
+        # at once, so irrelevant subtrees go before their children are tried.
+        depth = 0
+        while True:
+            base = FileManager.read_file(self.__temp_file)
+            level = [i for i, d in enumerate(get_depths(base)) if d == depth]
+            if not level: break
+            self.__reduce(level, lambda indices: remove_elements(base, indices))
+            depth += 1
+
+        base = FileManager.read_file(self.__temp_file)
+        pairs = [(i, attr) for i, names in enumerate(get_attributes(base)) for attr in names]
+        self.__reduce(pairs, lambda attrs: remove_attributes(base, attrs))
+
+    def __minimize_elements(self, transform):
+        # transform(text, i) of every element, the last one first
+        base = FileManager.read_file(self.__temp_file)
+        for i in reversed(range(len(get_depths(base)))):
+            text = transform(base, i)
+            if self.__test_candidate(text):
+                base = self.__min_html = text
+                FileManager.write_file(self.__temp_file, self.__min_html)
+
+    def __minimize_inner_element(self):
+        self.__minimize_elements(unwrap)
+
+    def __minimize_text(self):
+        self.__minimize_elements(clear_text)
+
+    def __minimize_js(self):
+        muts = self.__muts.copy()
+        for i in reversed(range(len(muts))):
+            removed = muts.pop(i)
+            if self.__test(self.__temp_file, muts):
+                self.__muts.pop(i)
+            else:
+                muts.insert(i, removed)
+
+
+    def __minimizing(self):
+        self.__minimize_js()
+        self.__minimize_style()
+        self.__minimize_dom()
+        self.__minimize_text()
+        self.__minimize_inner_element()
+
+
+    def minimize_queue(self) -> None:
+        # Minimizes the testcases of self.helper until it is drained, then
+        # helps the threads still minimizing.
+        cur_vers = None
+        hpr = self.helper
+        while True:
+            # an owner from the pop on, so helpers do not leave while
+            # a popped testcase is still to be minimized
+            hpr.coordinator.enter()
+            try:
+                popped = hpr.pop_from_queue(prefer=cur_vers)
+                if not popped and hpr.wait_for_input(): continue
+                if not popped: break
+
+                result, vers = popped
+                html_file, muts = result
+
+                if cur_vers != vers:
+                    cur_vers = vers
+                    self.__vers = vers
+                    if not self.start_browsers(cur_vers):
+                        continue
+
+                if self.__initial_test(html_file, muts):
+                    self.__minimizing()
+                    printf('BLUE', f'{basename(html_file)}: {self.__oracle_calls} oracle calls')
+                    hpr.record_minimization(self.__oracle_calls)
+
+                    if self.__test(self.__temp_file, self.__muts, use_cache=False):
+                        orig_html_file = os.path.splitext(html_file)[0] + '-orig.html'
+                        if os.path.exists(html_file): os.rename(html_file, orig_html_file)
+                        else: FileManager.write_file(orig_html_file, self.helper.read_testcase(html_file))
+                        copyfile(self.__temp_file, html_file)
+                        hpr.update_postq(vers, html_file, self.__muts)
+
+                self.__remove_temp_files()
+            finally:
+                hpr.coordinator.leave()
+
+        # the queue is drained, help the threads still minimizing
+        hpr.coordinator.serve(self.__evaluate)
@@ -0,0 +1,126 @@
+import hashlib
+
+from typing import Optional
+
+from threading import Lock, Thread
+from urllib.parse import quote, unquote, urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from os.path import join, abspath, commonpath, exists
+
+from utils.helper import FileManager
+
+# Testcase templates load the harness from this absolute path.
+HARNESS_PATH = '/tmp/metamor.js'
+
+class TestcaseServer:
+    def __init__(self, roots: list, host: str = '127.0.0.1', port: int = 0) -> None:
+        self.__roots = [abspath(root) for root in roots]
+
+        self.__pages = {}
+        self.__lock = Lock()
+
+        harness = join(FileManager.get_parent_dir(__file__), 'js', 'metamor.js')
+        self.__harness = FileManager.read_file(harness).encode()
+        self.__etag = '"' + hashlib.sha1(self.__harness).hexdigest() + '"'
+
+        self.__httpd = ThreadingHTTPServer((host, port), self.__make_handler())
+        self.__httpd.daemon_threads = True
+        self.__thread = None
+
+        self.url = f'http://{host}:{self.__httpd.server_port}'
+
+        # CorpusSet of testcases that are not files, see utils/corpus.py
+        self.corpus = None
+
+    def __make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.respond(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> None:
+        self.__thread = Thread(target=self.__httpd.serve_forever, daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.__httpd.shutdown()
+        self.__httpd.server_close()
+
+    def url_for(self, html_file: str) -> str:
+        return self.url + '/testcase' + quote(abspath(html_file))
+
+    def put_page(self, key: str, text: str) -> str:
+        with self.__lock:
+            self.__pages[key] = text.encode()
+        return f'{self.url}/page/{key}'
+
+    def drop_page(self, key: str) -> None:
+        with self.__lock:
+            self.__pages.pop(key, None)
+
+    def read_testcase(self, html_file: str) -> Optional[str]:
+        if self.corpus and not exists(html_file) and self.corpus.has(html_file):
+            return self.corpus.read(html_file)
+        try:
+            # newline='' keeps the bytes of the file as they are
+            with open(html_file, 'r', newline='') as fp:
+                return fp.read()
+        except (OSError, ValueError):
+            return
+
+    def __is_servable(self, path: str) -> bool:
+        for root in self.__roots:
+            if commonpath([root, path]) == root:
+                return True
+        return False
+
+    def __send(self, req, code: int, body: bytes = b'', ctype: str = 'text/html', headers: dict = {}):
+        req.send_response(code)
+        req.send_header('Content-Type', ctype)
+        req.send_header('Content-Length', str(len(body)))
+        for key in headers:
+            req.send_header(key, headers[key])
+        req.end_headers()
+        if body: req.wfile.write(body)
+
+    def respond(self, req) -> None:
+        path = unquote(urlsplit(req.path).path)
+        no_store = {'Cache-Control': 'no-store'}
+
+        # The harness never changes during a run, let the browser cache it.
+        if path == HARNESS_PATH:
+            headers = {'Cache-Control': 'public, max-age=86400', 'ETag': self.__etag}
+            if req.headers.get('If-None-Match') == self.__etag:
+                self.__send(req, 304, headers=headers)
+            else:
+                self.__send(req, 200, self.__harness, 'application/javascript', headers)
+
+        elif path.startswith('/page/'):
+            with self.__lock:
+                body = self.__pages.get(path[len('/page/'):])
+            if body is None: self.__send(req, 404)
+            else: self.__send(req, 200, body, headers=no_store)
+
+        elif path.startswith('/testcase/'):
+            html_file = abspath(path[len('/testcase'):])
+            if not self.__is_servable(html_file):
+                self.__send(req, 403)
+                return
+            if self.corpus and not exists(html_file) and self.corpus.has(html_file):
+                body = self.corpus.read_bytes(html_file)
+            else:
+                text = self.read_testcase(html_file)
+                if text is None:
+                    self.__send(req, 404)
+                    return
+                body = text.encode()
+            self.__send(req, 200, body, headers=no_store)
+
+        else:
+            self.__send(req, 404)
@@ -0,0 +1,68 @@
+import sys
+
+from pathlib import Path
+from os.path import join, dirname, abspath
+from multiprocessing import Process, Queue
+
+from utils.helper import FileManager
+
+DOMATO_DIR = join(dirname(dirname(abspath(__file__))), 'domato')
+
+def generate_worker(index: int, num_of_workers: int, seed: int, num: int,
+                    spool_dir: str, queue: Queue) -> None:
+    # Worker i generates the seeds seed + i, seed + i + n, ... so the set of
+    # testcases only depends on the seed, not on the scheduling.
+    sys.path.insert(0, DOMATO_DIR)
+    from generator import setup_grammars, generate_seeded_sample
+
+    template = FileManager.read_file(join(DOMATO_DIR, 'template.html'))
+    grammars = setup_grammars()
+    if grammars:
+        htmlgrammar, cssgrammar = grammars
+        cur = index
+        while not num or cur < num:
+            manifest = {}
+            html = generate_seeded_sample(template, htmlgrammar, cssgrammar, seed + cur, manifest)
+            html_file = join(spool_dir, f'seed-{seed + cur}.html')
+            FileManager.write_file(html_file, html)
+            queue.put((html_file, manifest))
+            cur += num_of_workers
+    queue.put(None)
+
+
+class GenerationSource:
+    # Generates testcases on demand in background processes. Testcases are
+    # written to the spool directory, the bounded queue keeps the number of
+    # files waiting there constant. num = 0 generates forever.
+    def __init__(self, spool_dir: str, seed: int = 0, num: int = 0,
+                 num_of_workers: int = 2, bound: int = 64) -> None:
+        self.spool_dir = spool_dir
+        self.seed = seed
+        self.num = num
+        self.num_of_workers = num_of_workers
+
+        self.__queue = Queue(bound)
+        self.__workers = []
+
+    def start(self) -> None:
+        Path(self.spool_dir).mkdir(parents=True, exist_ok=True)
+        for i in range(self.num_of_workers):
+            args = (i, self.num_of_workers, self.seed, self.num, self.spool_dir, self.__queue)
+            p = Process(target=generate_worker, args=args, daemon=True)
+            p.start()
+            self.__workers.append(p)
+
+    def __iter__(self):
+        finished = 0
+        while finished < self.num_of_workers:
+            item = self.__queue.get()
+            if item is None:
+                finished += 1
+                continue
+            yield item
+
+    def stop(self) -> None:
+        for p in self.__workers:
+            if p.is_alive(): p.terminate()
+        for p in self.__workers:
+            p.join()
@@ -0,0 +1,101 @@
+import json
+import sqlite3
+
+from threading import Lock
+from os.path import exists
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    stage TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    html_file TEXT NOT NULL,
+    vers TEXT NOT NULL,
+    muts TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (stage, kind, html_file)
+);
+CREATE TABLE IF NOT EXISTS stages (
+    stage TEXT PRIMARY KEY
+);
+"""
+
+# Durable copy of IOQueue. Each stage has 'in' items, which it pops, and
+# 'out' items, which it produces. An 'in' item is pending, running (popped,
+# attempts counts the pops) or done. Completed stages are recorded so that
+# a run can be resumed at the first incomplete one.
+class QueueStore:
+    def __init__(self, path: str, resume: bool = False) -> None:
+        if not resume and exists(path):
+            raise ValueError(f'{path} exists, use --resume to continue the run')
+        if resume and not exists(path):
+            raise ValueError(f'{path} does not exist, there is no run to resume')
+
+        self.__lock = Lock()
+        self.__conn = sqlite3.connect(path, check_same_thread=False)
+        self.__conn.execute('PRAGMA journal_mode=WAL')
+        self.__conn.execute('PRAGMA synchronous=NORMAL')
+        self.__conn.executescript(SCHEMA)
+        self.__conn.commit()
+
+        self.stage = None
+
+    def __execute(self, sql: str, args: tuple = (), commit: bool = True):
+        with self.__lock:
+            cur = self.__conn.execute(sql, args)
+            if commit: self.__conn.commit()
+            return cur
+
+    def commit(self) -> None:
+        with self.__lock:
+            self.__conn.commit()
+
+    def add(self, kind: str, vers: tuple, html_file: str, muts: list, commit: bool = True) -> None:
+        # Re-inserting an item (e.g. a narrowed bisection interval) makes
+        # it pending again but keeps its attempts.
+        self.__execute(
+            'INSERT INTO items (stage, kind, html_file, vers, muts, status) '
+            'VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (stage, kind, html_file) DO UPDATE SET '
+            'vers = excluded.vers, muts = excluded.muts, status = excluded.status',
+            (self.stage, kind, html_file, json.dumps(vers), json.dumps(muts),
+             'pending' if kind == 'in' else 'done'), commit)
+
+    def start(self, html_file: str) -> None:
+        self.__execute(
+            "UPDATE items SET status = 'running', attempts = attempts + 1 "
+            "WHERE stage = ? AND kind = 'in' AND html_file = ?",
+            (self.stage, html_file))
+
+    def finish(self, html_file: str) -> None:
+        self.__execute(
+            "UPDATE items SET status = 'done' "
+            "WHERE stage = ? AND kind = 'in' AND html_file = ? AND status = 'running'",
+            (self.stage, html_file))
+
+    def complete_stage(self, commit: bool = True) -> None:
+        self.__execute('INSERT OR IGNORE INTO stages (stage) VALUES (?)', (self.stage,), commit)
+
+    def is_completed(self, stage: str) -> bool:
+        cur = self.__execute('SELECT 1 FROM stages WHERE stage = ?', (stage,), False)
+        return cur.fetchone() is not None
+
+    def load(self, kind: str, max_attempts: int = 0) -> list:
+        # Pending and interrupted items of the current stage, or its outputs.
+        if kind == 'in':
+            sql = ("SELECT vers, html_file, muts, attempts FROM items "
+                   "WHERE stage = ? AND kind = 'in' AND status != 'done'")
+        else:
+            sql = ("SELECT vers, html_file, muts, attempts FROM items "
+                   "WHERE stage = ? AND kind = 'out'")
+
+        items = []
+        for vers, html_file, muts, attempts in self.__execute(sql, (self.stage,), False).fetchall():
+            if max_attempts and attempts >= max_attempts: continue
+            items.append((tuple(json.loads(vers)), html_file, json.loads(muts)))
+        return items
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__conn.commit()
+            self.__conn.close()
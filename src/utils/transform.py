@@ -0,0 +1,87 @@
+from typing import Optional
+
+from lxml import html as lhtml
+from lxml import etree
+
+from utils.analyzer import get_elements
+
+# Offline reduction transforms of the Minimizer, elements are indexed like
+# document.body.querySelectorAll('*'). Every transform returns the
+# serialized candidate, or None if the testcase does not parse.
+
+def parse(text: str):
+    try:
+        return lhtml.document_fromstring(text)
+    except (etree.ParserError, ValueError):
+        return
+
+def serialize(doc) -> str:
+    return lhtml.tostring(doc, doctype='<!DOCTYPE html>', encoding='unicode')
+
+def get_depths(text: str) -> list:
+    # depth of every element below the body
+    doc = parse(text)
+    if doc is None: return []
+    body = doc.find('body')
+    depths = []
+    for e in get_elements(doc):
+        depth = 0
+        for p in e.iterancestors():
+            if p is body: break
+            depth += 1
+        depths.append(depth)
+    return depths
+
+def get_attributes(text: str) -> list:
+    doc = parse(text)
+    if doc is None: return []
+    return [list(e.attrib) for e in get_elements(doc)]
+
+def remove_elements(text: str, indices: list) -> Optional[str]:
+    # with their subtrees, the text following an element is kept
+    doc = parse(text)
+    if doc is None: return
+    elements = get_elements(doc)
+    for i in indices:
+        elements[i].drop_tree()
+    return serialize(doc)
+
+def remove_attributes(text: str, attrs: list) -> Optional[str]:
+    # attrs: (index, attribute name) pairs
+    doc = parse(text)
+    if doc is None: return
+    elements = get_elements(doc)
+    for i, name in attrs:
+        elements[i].attrib.pop(name, None)
+    return serialize(doc)
+
+def clear_text(text: str, index: int) -> Optional[str]:
+    # element.textContent = ''
+    doc = parse(text)
+    if doc is None: return
+    e = get_elements(doc)[index]
+    for child in list(e):
+        e.remove(child)
+    e.text = None
+    return serialize(doc)
+
+def unwrap(text: str, index: int) -> Optional[str]:
+    # the element is replaced by its children
+    doc = parse(text)
+    if doc is None: return
+    get_elements(doc)[index].drop_tag()
+    return serialize(doc)
+
+def get_style(text: str) -> Optional[str]:
+    # the first <style>, document.styleSheets[0]
+    doc = parse(text)
+    if doc is None: return
+    for style in doc.iter('style'):
+        return style.text or ''
+
+def set_style(text: str, css: str) -> Optional[str]:
+    doc = parse(text)
+    if doc is None: return
+    for style in doc.iter('style'):
+        style.text = css
+        return serialize(doc)